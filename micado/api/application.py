@@ -4,10 +4,13 @@ Low-level methods for managing applications in MiCADO
 
 """
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from micado.types import ApplicationInfo
 from micado.exceptions import detailed_raise_for_status
 
+DESTROY_WORKERS = 8  # applications deleted concurrently by _destroy()
+
 class ApplicationMixin:
     def applications(self):
         """Lists the currently running applications
@@ -80,29 +83,49 @@ class ApplicationMixin:
         detailed_raise_for_status(resp)
         return resp.json()
 
-    def delete_app(self, app_id, force=False):
+    def delete_app(self, app_id, force=False, timeout=None):
         """Delete an application in MiCADO
 
         Args:
             app_id (string): ID of application to delete
             force (bool, optional): Ignore errors. Defaults to False.
+            timeout (float, optional): Seconds to wait for the response.
+                Defaults to None, waiting as long as it takes.
 
         Returns:
             dict: ID and status of deletion
         """
         url = self._url(f"/applications/{app_id}/")
         json_data = {"force": force}
-        resp = self.delete(url, json=json_data)
+        resp = self.delete(url, json=json_data, timeout=timeout)
         if not force:
             detailed_raise_for_status(resp)
         return resp.json()
 
-    def _destroy(self):
-        """Deletes all application in MiCADO
+    def _destroy(self, timeout=None, workers=DESTROY_WORKERS):
+        """Deletes all application in MiCADO, concurrently
 
         This should normally only be called by a launcher that
         is ready to destroy the entire MiCADO stack
+
+        Args:
+            timeout (float, optional): Seconds to wait for all deletions.
+                Defaults to None, waiting as long as it takes.
+            workers (int, optional): Applications deleted at once.
+                Defaults to DESTROY_WORKERS.
+
+        Returns:
+            list: IDs of the applications which failed to delete in time
         """
         app_ids = self.applications()
-        for app in app_ids:
-            self.delete_app(app, force=True)
+        if not app_ids:
+            return []
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(app_ids)))
+        deletions = {
+            pool.submit(self.delete_app, app, force=True, timeout=timeout): app
+            for app in app_ids
+        }
+        done, pending = wait(deletions, timeout=timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+        failed = [deletion for deletion in done if deletion.exception()]
+        return [deletions[deletion] for deletion in [*failed, *pending]]
@@ -10,12 +10,27 @@ from requests.exceptions import ConnectionError
 from ruamel.yaml import YAML
 
 from micado.settings import CONFIGS, DEMOS, CLOUDS, warned_vault
+from micado.installer.ansible.fingerprint import (
+    AUTH_TAGS,
+    FULL_RUN,
+    Fingerprints,
+    fingerprint_file,
+    join_tags,
+)
 from micado.installer.ansible.playbook import Playbook
+from micado.installer.ansible.progress import (
+    FAILED,
+    EventPipeline,
+    ProgressReporter,
+    TaskTimer,
+)
 from micado import MicadoClient, exceptions
 
 yaml = YAML()
 
 DEFAULT_VERS = "v0.12.6"
+CONFIG_TAGS = {"cloud": AUTH_TAGS, "gcp": AUTH_TAGS, "registry": AUTH_TAGS}
+SLOWEST_ROLES = 5  # roles listed in the timing summary of `micado up`
 
 class OrderedGroup(click.Group):
     def list_commands(self, ctx) -> list[str]:
@@ -141,11 +156,10 @@ def init(target, version, force):
     playbook = Playbook(version, f"{os.getlogin()}-cli", f"{target}/")
     playbook.playbook_path = f"{target}/.micado"
     try:
-        playbook.download()
+        playbook.fetch()
     except TypeError:
         click.secho(f"Cannot find MiCADO version {version}", fg="red")
         sys.exit(1)
-    playbook.extract()
 
     click.secho(
         f"Succesfully initialised the MiCADO setup in {target_text}", fg="green"
@@ -199,8 +213,22 @@ def config(config):
     is_flag=True,
     help="Updates cloud and registry credentials of an existing cluster.",
 )
-def up(vault, update_auth):
-    """Deploys a MiCADO cluster as per the configuration"""
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Runs every step, even for configuration unchanged since the last run.",
+)
+@click.option(
+    "--verbose",
+    is_flag=True,
+    help="Shows the full Ansible output instead of a task summary.",
+)
+def up(vault, update_auth, full, verbose):
+    """Deploys a MiCADO cluster as per the configuration
+
+    Only the steps affected by configuration changed since the last
+    successful run are repeated, unless --full is given.
+    """
     if not os.path.exists("".join(CONFIGS["hosts"][1:])):
         click.secho(f"MiCADO host not configured! Use `micado config hosts`", fg="red")
         sys.exit(1)
@@ -209,21 +237,42 @@ def up(vault, update_auth):
             f"Deploying with no clouds configured. Use `micado config cloud`", fg="yellow"
         )
 
+    fingerprints = Fingerprints(Path(".micado") / "fingerprints.json", CONFIG_TAGS)
+    current = {
+        name: fingerprint_file(get_actual_config_file(file))
+        for name, file in CONFIGS.items()
+    }
+    tags = {AUTH_TAGS} if update_auth else fingerprints.changed_tags(current, full)
+    if tags is not FULL_RUN and not tags:
+        click.secho("MiCADO is up to date. Use --full to deploy again.", fg="green")
+        return
+
     password = (
         click.prompt("Enter the vault password", type=str, hide_input=True)
         if vault
         else ""
     )
     cmdline = "--ask-vault-pass " if vault else " "
-    cmdline += "--tags update-auth" if update_auth else ""
+    cmdline += f"--tags {join_tags(tags)}" if tags else ""
     passwords = {"^Vault password:\\s*?$": password} if vault else {}
 
-    ansible_runner.run(
+    timer = TaskTimer()
+    progress = None if verbose else ProgressReporter(print_progress)
+    runner = ansible_runner.run(
         playbook="micado.yml",
         cmdline=cmdline,
         passwords=passwords,
         private_data_dir="./.micado/playbook",
+        event_handler=EventPipeline(timer, progress),
+        quiet=not verbose,
     )
+    print_timings(timer, runner.config.artifact_dir)
+    if runner.rc == 0:
+        fingerprints.save(current, tags)
+        click.secho("MiCADO is up.", fg="green")
+    else:
+        click.secho(f"Deployment {runner.status}.", fg="red")
+        sys.exit(1)
 
 @cli.command()
 def edge():
@@ -252,6 +301,24 @@ def get_client() -> MicadoClient:
         password
     )
 
+def print_progress(progress):
+    if progress.status == "started":
+        role = f"{progress.role} : " if progress.role else ""
+        click.echo(f"{role}{progress.task}")
+    elif progress.status in FAILED:
+        click.secho(
+            f"  {progress.status} on {progress.host}: {progress.message}", fg="red"
+        )
+
+def print_timings(timer, artifact_dir):
+    report = timer.report()
+    if not report["roles"]:
+        return
+    click.secho(f"\nSlowest roles, of {report['total']:.0f}s in total:", bold=True)
+    for role in report["roles"][:SLOWEST_ROLES]:
+        click.echo(f"  {role['duration']:7.1f}s  {role['role'] or '(no role)'}")
+    click.echo(f"Task timings saved to {timer.write(artifact_dir)}")
+
 def directory_is_not_empty(dir) -> bool:
     try:
         return bool(os.listdir(dir))
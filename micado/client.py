@@ -6,27 +6,11 @@ Higher-level client for both submitter interaction and launching ability
 
 import os
 
-from .api.client import SubmitterClient
-
-from .launcher.openstack import OpenStackLauncher
-from .launcher.cloudbroker import CloudBrokerLauncher
-
-from .installer.ansible import AnsibleInstaller
-
 from .models.application import Applications
-from .models.micado import Micado
 
+from .plugins import LAUNCHERS, INSTALLER
 from .exceptions import MicadoException
 
-LAUNCHERS = {
-    "openstack": OpenStackLauncher,
-    "cloudbroker": CloudBrokerLauncher,
-}
-
-INSTALLER = {
-    "ansible": AnsibleInstaller,
-}
-
 
 class MicadoClient:
     """The MiCADO Client
@@ -149,6 +133,8 @@ class MicadoClient:
             except KeyError:
                 raise MicadoException(f"Unknown installer: {installer}")
         else:
+            from .api.client import SubmitterClient
+
             self.api = SubmitterClient(*args, **kwargs)
 
     @classmethod
@@ -203,4 +189,6 @@ class MicadoClient:
     def micado(self):
         if not self.launcher:
             raise MicadoException("No launcher defined")
+        from .models.micado import Micado
+
         return Micado(client=self)
@@ -1,6 +1,3 @@
-from requests.exceptions import HTTPError
-
-
 class MicadoException(Exception):
     """Base class for exceptions"""
 
@@ -16,6 +13,8 @@ def detailed_raise_for_status(resp):
     Raises:
         Exception: MicadoException or the original HTTPError
     """
+    from requests.exceptions import HTTPError
+
     try:
         resp.raise_for_status()
     except HTTPError as e:
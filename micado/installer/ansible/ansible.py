@@ -1,23 +1,46 @@
 import logging
 import logging.config
 import os
-import paramiko
 import requests
-import socket
-import subprocess
-import time
+import uuid
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 from requests.adapters import Retry, HTTPAdapter
 
+from micado.installer.ansible.fingerprint import (
+    AUTH_TAGS,
+    FULL_RUN,
+    Fingerprints,
+    fingerprint_data,
+    fingerprint_file,
+    join_tags,
+)
 from micado.installer.ansible.playbook import Playbook
+from micado.installer.ansible.ports import wait_for_ports
+from micado.installer.ansible.progress import failure_summary
+from micado.installer.ansible.ssh import SSHSession, update_known_host
 from micado.exceptions import MicadoException
+from micado.settings import CONFIGS
+from micado.types.micado import completed_phases
 from micado.utils.utils import DataHandling, generate_password
 from ruamel.yaml import YAML
 
 DEFAULT_PATH = Path.home() / ".micado-cli"
 DEFAULT_VERS = "v0.11.0"
 API_VERS = "v2.0"
+BUILD_TAGS = "build"  # install components only, for baking an image
+START_TAGS = "start"  # configure and start components on a baked image
+MAX_FORKS = 20  # upper bound on parallel hosts in a multi-node run
+FINGERPRINTS = "fingerprints"  # input fingerprints, per MiCADO ID, in the home directory
+INPUT_TAGS = {
+    "cloud": AUTH_TAGS,
+    "registry": AUTH_TAGS,
+    "settings": FULL_RUN,
+    "advanced": FULL_RUN,
+}
+HOST_SECURITY = "micado_host_security"  # per-host credentials in a multi-node run
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -44,6 +67,15 @@ class AnsibleInstaller:
     api_version = os.environ.get("API_VERS", API_VERS)
     home = str(Path(os.environ.get("MICADO_DIR", DEFAULT_PATH))) + "/"
 
+    def prepare(self, **kwargs):
+        """Get ready for deploy() without the VM, so it can run while the
+        VM boots: fetch and extract the playbook if it is not cached.
+        """
+        playbook = Playbook(self.micado_version, "prepare", self.home)
+        if not playbook.playbook_exists():
+            logger.info("Fetching playbook...")
+            playbook.fetch()
+
     def deploy(
         self,
         micado,
@@ -52,32 +84,251 @@ class AnsibleInstaller:
         terraform=True,
         occopus=False,
         wireguard=True,
+        baked=False,
+        accelerate=False,
+        full=False,
+        on_progress=None,
+        phase=None,
+        checkpoint=None,
+        tags=None,
         **kwargs,
     ):
+        """Deploy MiCADO on a VM, skipping the phases an earlier attempt
+        completed.
+
+        The credentials are stored before the playbook runs, so a resumed
+        deploy can reuse them.
+
+        Args:
+            phase (string, optional): Last phase completed, from PHASES
+            checkpoint (callable, optional): Called with the name of each
+                phase as it completes
+            tags (string, optional): Only run these playbook tags, e.g.
+                START_TAGS to apply new MiCADO credentials to an installed
+                node, or AUTH_TAGS to re-apply its cloud and registry ones
+        """
         instance_ip = micado.ip
         micado_id = micado.id
+        done = completed_phases(phase)
+        checkpoint = checkpoint or (lambda phase: None)
 
         logger.info("Check instance availability...")
-        self._check_availability(instance_ip)
+        if "ports_open" not in done:
+            self._check_port_availability(instance_ip, 22)
+            checkpoint("ports_open")
+        with self._check_ssh_availability(instance_ip) as ssh:
+            micado_password = micado_password or generate_password()
+            self._store_data(micado_id, self.api_version, micado_user, micado_password)
+
+            if "playbook_done" in done:
+                logger.info("Playbook already complete, skipping...")
+            else:
+                logger.info("Generating playbook inputs...")
+                hosts = self._generate_inventory(instance_ip, ssh)
+                extravars = self._generate_extravars(
+                    micado_user, micado_password, terraform, occopus, wireguard
+                )
+                if tags:
+                    logger.info(f"Running playbook tags: {tags}...")
+                    self._run_playbook(
+                        micado_id,
+                        hosts,
+                        extravars,
+                        tags,
+                        accelerate,
+                        on_progress=on_progress,
+                    )
+                elif baked:
+                    logger.info("Running playbook finalisation on baked image...")
+                    self._run_playbook(
+                        micado_id,
+                        hosts,
+                        extravars,
+                        START_TAGS,
+                        accelerate,
+                        on_progress=on_progress,
+                    )
+                else:
+                    logger.info("Running playbook...")
+                    self._run_playbook(
+                        micado_id,
+                        hosts,
+                        extravars,
+                        accelerate=accelerate,
+                        full=full,
+                        on_progress=on_progress,
+                    )
+                checkpoint("playbook_done")
+            self._check_submitter(instance_ip, micado_user, micado_password)
+            logger.info("MiCADO deployed!")
+
+            if "cert_fetched" not in done:
+                self._get_self_signed_cert(ssh, micado_id)
+                checkpoint("cert_fetched")
+        logger.info(f"MiCADO ID is: {micado_id}")
 
-        logger.info("Generating playbook inputs...")
-        micado_password = micado_password or generate_password()
-        hosts = self._generate_inventory(instance_ip)
-        extravars = self._generate_extravars(
-            micado_user, micado_password, terraform, occopus, wireguard
-        )
+    def deploy_many(
+        self,
+        micados,
+        micado_user="admin",
+        micado_password=None,
+        terraform=True,
+        occopus=False,
+        wireguard=True,
+        accelerate=False,
+        on_progress=None,
+        **kwargs,
+    ):
+        """Deploy MiCADO on several VMs with a single playbook run
 
-        logger.info("Running playbook...")
-        self._run_playbook(micado_id, hosts, extravars)
-        self._check_submitter(instance_ip, micado_user, micado_password)
-        logger.info("MiCADO deployed!")
+        Each VM gets its own inventory host, with the MiCADO settings that
+        deploy() applies through host_vars/micado.yml, and its own
+        credentials (a generated password, unless one is given). The
+        credentials reach the playbook as extravars, as in deploy(), and are
+        stored before it runs. A failure on one VM does not affect the others.
+
+        Args:
+            micados (list): MicadoInfo of each VM
+            Others as per deploy()
+
+        Returns:
+            dict: "Deployed" or the reason of failure, by MiCADO ID
+        """
+        results = {}
+        with ExitStack() as stack:
+            logger.info("Check instance availability...")
+            with ThreadPoolExecutor(max_workers=MAX_FORKS) as pool:
+                checks = {
+                    micado.id: pool.submit(self._check_availability, micado.ip)
+                    for micado in micados
+                }
+            sessions = {}
+            for micado_id, check in checks.items():
+                try:
+                    sessions[micado_id] = stack.enter_context(check.result())
+                except Exception as e:
+                    logger.error(f"{micado_id} is not available: {e}")
+                    results[micado_id] = f"Failed: {e}"
+            ready = [micado for micado in micados if micado.id in sessions]
+            if not ready:
+                return results
+
+            logger.info("Generating playbook inputs...")
+            playbook = Playbook(self.micado_version, f"batch-{uuid.uuid4().hex}", self.home)
+            if not playbook.playbook_exists():
+                playbook.fetch()
+            settings = self._load_settings(playbook)
+            passwords = {}
+            hosts = {}
+            for micado in ready:
+                passwords[micado.id] = micado_password or generate_password()
+                self._store_data(
+                    micado.id, self.api_version, micado_user, passwords[micado.id]
+                )
+                hosts[micado.id] = dict(settings)
+                hosts[micado.id].update(self._generate_host(micado.ip, sessions[micado.id]))
+                hosts[micado.id][HOST_SECURITY] = self._generate_credential_data(
+                    micado_user, passwords[micado.id]
+                )
+            inventory = {"all": {"children": {"micado": {"hosts": hosts}}}}
+            extravars = self._generate_extravars(
+                micado_user, None, terraform, occopus, wireguard
+            )
+            extravars["security"] = "{{ %s }}" % HOST_SECURITY  # resolved per host
+
+            logger.info(f"Running playbook on {len(ready)} nodes...")
+            runner = playbook.run(
+                inventory,
+                extravars,
+                forks=min(len(ready), MAX_FORKS),
+                accelerate=accelerate,
+                on_progress=on_progress,
+            )
+            failed = self._failed_hosts(runner, hosts)
+
+            for micado in ready:
+                if micado.id in failed:
+                    logger.error(f"Playbook failed on {micado.id}")
+                    results[micado.id] = "Failed: playbook"
+                    continue
+                try:
+                    self._check_submitter(micado.ip, micado_user, passwords[micado.id])
+                    self._get_self_signed_cert(sessions[micado.id], micado.id)
+                except Exception as e:
+                    logger.error(f"{micado.id} failed after the playbook: {e}")
+                    results[micado.id] = f"Failed: {e}"
+                else:
+                    logger.info(f"MiCADO deployed on {micado.id}!")
+                    results[micado.id] = "Deployed"
+        return results
+
+    @staticmethod
+    def _failed_hosts(runner, hosts):
+        """Return the hosts which failed or were unreachable in a run
+
+        Without stats, e.g. when the run stopped before the play recap,
+        every host failed unless the run succeeded.
+        """
+        stats = runner.stats or {}
+        if not stats:
+            return set() if runner.rc == 0 else set(hosts)
+        return {
+            host
+            for key in ("failures", "dark")
+            for host, count in (stats.get(key) or {}).items()
+            if count
+        }
+
+    def _load_settings(self, playbook):
+        """Return the MiCADO settings of host_vars/micado.yml, which Ansible
+        applies only to a host named micado"""
+        folder, name, ext = CONFIGS["settings"]
+        path = playbook.playbook_path / folder / f"{name}{ext}"
+        if not path.is_file():
+            return {}
+        with open(path) as f:
+            return dict(YAML(typ="safe").load(f) or {})
+
+    def build(
+        self,
+        micado,
+        micado_user="admin",
+        terraform=True,
+        occopus=False,
+        wireguard=True,
+        accelerate=False,
+        on_progress=None,
+        **kwargs,
+    ):
+        """Install MiCADO components without starting them, ready for
+        the VM to be snapshotted and later finalised with deploy(baked=True)
+        """
+        logger.info("Check instance availability...")
+        with self._check_availability(micado.ip) as ssh:
+            logger.info("Generating playbook inputs...")
+            hosts = self._generate_inventory(micado.ip, ssh)
+            extravars = self._generate_extravars(
+                micado_user, generate_password(), terraform, occopus, wireguard
+            )
+
+            logger.info("Running playbook build...")
+            self._run_playbook(
+                micado.id,
+                hosts,
+                extravars,
+                BUILD_TAGS,
+                accelerate,
+                on_progress=on_progress,
+            )
+        logger.info("MiCADO built!")
 
-        self._get_self_signed_cert(instance_ip, micado_id)
-        self._store_data(micado_id, self.api_version, micado_user, micado_password)
-        logger.info(f"MiCADO ID is: {micado_id}")
-        
     def _check_submitter(self, instance_ip, user, passw):
-        """Check the submitter endpoint is returning 200"""
+        """Check the submitter endpoint is returning 200
+
+        Raises:
+            MicadoException: When it does not, e.g. 401 when the MiCADO
+                credentials were not applied
+        """
         self._check_port_availability(instance_ip, 443)
         s = requests.Session()
         s.auth = (user, passw)
@@ -85,31 +336,101 @@ class AnsibleInstaller:
         
         retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
         s.mount("https://", HTTPAdapter(max_retries=retries))
-        s.get(f"https://{instance_ip}/toscasubmitter/v2.0/applications/")
+        r = s.get(f"https://{instance_ip}/toscasubmitter/v2.0/applications/")
+        if r.status_code != 200:
+            raise MicadoException(
+                f"Submitter check failed with status code {r.status_code}"
+            )
 
     def _check_availability(self, instance_ip):
-        """Perform availability checks"""
+        """Perform availability checks, returning the open SSH session"""
         self._check_port_availability(instance_ip, 22)
-        self._remove_know_host()
-        self._get_ssh_fingerprint(instance_ip)
-        self._check_ssh_availability(instance_ip)
+        return self._check_ssh_availability(instance_ip)
+
+    def _run_playbook(
+        self,
+        micado_id,
+        hosts,
+        extravars,
+        tags=None,
+        accelerate=False,
+        full=False,
+        on_progress=None,
+    ):
+        """Run the playbook
 
-    def _run_playbook(self, micado_id, hosts, extravars):
-        """Run the playbook"""
+        Without tags, only the tags affected by inputs that changed since
+        the last successful run are run, unless full is set.
+        """
         playbook = Playbook(self.micado_version, micado_id, self.home)
-        runner = playbook.run(hosts, extravars)
+        fingerprints = None
+        if tags is None:
+            fingerprints = Fingerprints(
+                Path(self.home) / FINGERPRINTS / f"{micado_id}.json", INPUT_TAGS
+            )
+            current = self._fingerprint_inputs(hosts, extravars, playbook)
+            changed = fingerprints.changed_tags(current, full)
+            if changed is not FULL_RUN and not changed:
+                logger.info("Playbook inputs unchanged, nothing to run.")
+                return
+            tags = join_tags(changed)
+            if tags:
+                logger.info(f"Playbook inputs changed, running tags: {tags}")
+
+        runner = playbook.run(
+            hosts, extravars, tags=tags, accelerate=accelerate, on_progress=on_progress
+        )
         if runner.rc == 0:
             logger.info("Playbook complete.")
+            if fingerprints:
+                fingerprints.save(current, changed)
         else:
-            msg = "\n".join([event["stdout"] for event in list(runner.events)[-5:]])
+            events = list(runner.events)
+            msg = failure_summary(events) or "\n".join(
+                [event["stdout"] for event in events[-5:]]
+            )
             logger.error(msg)
             raise MicadoException(msg)
 
-    def _generate_inventory(self, ip):
+    def _fingerprint_inputs(self, hosts, extravars, playbook):
+        """Fingerprint the inventory, extravars, credential files and the
+        MiCADO settings of the playbook
+
+        Args:
+            hosts (dict): Inventory, without its per-session SSH arguments
+            extravars (dict): Extra variables, which embed the MiCADO credentials
+            playbook (Playbook): Playbook holding the settings files
+        """
+        inputs = {
+            "hosts": fingerprint_data(hosts, ignore=("ansible_ssh_common_args",)),
+            "extravars": fingerprint_data(extravars),
+            "cloud": fingerprint_file(extravars["cloud_cred_path"]),
+            "registry": fingerprint_file(extravars["registry_cred_path"]),
+        }
+        for config in ("settings", "advanced"):
+            folder, name, ext = CONFIGS[config]
+            inputs[config] = fingerprint_file(
+                playbook.playbook_path / folder / f"{name}{ext}"
+            )
+        return inputs
+
+    def _generate_inventory(self, ip, ssh=None):
         """Generate hosts info for Playbook
 
         Args:
             ip (string): MiCADO IP
+            ssh (SSHSession, optional): Open session for Ansible to reuse
+        """
+        hosts = {"all": {"hosts": {"micado": self._generate_host(ip, ssh)}}}
+
+        return hosts
+
+    def _generate_host(self, ip, ssh=None):
+        """Generate the inventory variables of a single host
+
+        Args:
+            ip (string): MiCADO IP
+            ssh (SSHSession, optional): Open session for Ansible to reuse
         """
         host_dict = {}
         host_dict[
@@ -117,11 +438,14 @@ class AnsibleInstaller:
         ] = f"{self.home}micado_cli_config_priv_key"
         host_dict["ansible_host"] = ip
         host_dict["ansible_user"] = "ubuntu"
-        hosts = {"all": {"hosts": {"micado": host_dict}}}
+        if ssh:
+            host_dict["ansible_ssh_common_args"] = ssh.ansible_ssh_args
 
-        return hosts
+        return host_dict
 
-    def _generate_extravars(self, micado_user, micado_password, terraform, occopus):
+    def _generate_extravars(
+        self, micado_user, micado_password, terraform, occopus, wireguard
+    ):
         """Configure ansible-micado, with credentials, etc...
 
         Args:
@@ -129,6 +453,7 @@ class AnsibleInstaller:
             micado_password (string): User defined MiCADO password
             terraform (boolean): Terraform enabled
             occopus (boolean): Occopus enabled
+            wireguard (boolean): Wireguard enabled
         """
 
         security_dict = self._generate_credential_data(micado_user, micado_password)
@@ -168,99 +493,32 @@ class AnsibleInstaller:
 
         return credential_dict
 
-    def _check_port_availability(self, ip, port):
-        """Check the given port availability.
+    def _check_port_availability(self, ip, *ports):
+        """Wait for the given ports to be available, probing them concurrently.
 
         Args:
             ip (string): IP address of the VM
-            port (string): Port number
+            ports (int): Port numbers
 
         Raises:
-            Exception: When timeout reached
-        """
-        logger.info("Check {} port availability...".format(port))
-        attempts = 0
-        sleep_time = 2
-        max_attempts = 1000
-        result = None
-        logger.debug(
-            "IP: {} \tPort: {} \tsleeptime:{}".format(
-                ip,
-                port,
-                sleep_time,
-            )
-        )
-        while attempts < max_attempts and result != 0:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            socket.setdefaulttimeout(1)
-            result = s.connect_ex((ip, port))
-            s.close()
-            attempts += 1
-            if result == 0:
-                logger.info("{} port is available...".format(port))
-                break
-            logger.debug(
-                "attempts:{}/{} Still no answer. Try again {} seconds later...".format(
-                    attempts, max_attempts, sleep_time
-                )
-            )
-            time.sleep(sleep_time)
-
-        if attempts == max_attempts:
-            raise Exception(
-                "{} second passed, and still cannot reach {}.".format(
-                    attempts * sleep_time, port
-                )
-            )
-
-    def _remove_know_host(self):
-        """Remove known_host file"""
-        known_hosts = str(Path.home()) + "/.ssh/known_hosts"
-        if not os.path.isfile(known_hosts):
-            return
-        with open(known_hosts) as file:
-            all_lines = file.readlines()
-        with open(known_hosts + ".old", "a") as file2:
-            file2.writelines(all_lines)
-        os.remove(known_hosts)
-
-    def _get_ssh_fingerprint(self, ip):
-        """Get SSH fingerprint
+            MicadoException: When timeout reached
 
-        Args:
-            ip (string): Target IP address
+        Returns:
+            dict: Seconds until each port opened, by port
         """
-        known_hosts = str(Path.home()) + "/.ssh/known_hosts"
-        result = subprocess.run(
-            ["ssh-keyscan", "-H", ip],
-            shell=False,
-            stdin=None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-        )
-        with open(known_hosts, "a") as f:
-            f.writelines(result.stdout.decode())
+        logger.info("Check {} port availability...".format(
+            ", ".join(str(port) for port in ports)))
+        return wait_for_ports(ip, ports)
 
-    def _get_self_signed_cert(self, ip, id):
+    def _get_self_signed_cert(self, ssh, id):
         """Get MiCADO self signed SSL
 
         Args:
-            ip (string): Target IP
+            ssh (SSHSession): Open session to the VM
             id (string): UUID of the VM
         """
         logger.info("Get MiCADO self_signed cert")
-
-        key = paramiko.RSAKey.from_private_key_file(
-            f"{self.home}micado_cli_config_priv_key"
-        )
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(hostname=ip, username="ubuntu", pkey=key)
-        sftp = ssh.open_sftp()
-        sftp.get("/var/lib/micado/zorp/config/ssl.pem", f"{self.home}{id}-ssl.pem")
-        sftp.close()
-        ssh.close()
+        ssh.get("/var/lib/micado/zorp/config/ssl.pem", f"{self.home}{id}-ssl.pem")
 
     def _store_data(self, server_id, api_version, micado_user, micado_password):
         """Persist configuration specific data
@@ -292,47 +550,27 @@ class AnsibleInstaller:
         return self.api_version
 
     def _check_ssh_availability(self, ip):
-        """Check SSH availability
+        """Open the SSH session once cloud-init accepts our key, and record
+        the host key it accepted in ~/.ssh/known_hosts
 
         Args:
             ip (string): Target IP
 
         Raises:
-            Exception: When timeout reached
-        """
-        attempts = 0
-        sleep_time = 2
-        max_attempts = 100
-        while attempts < max_attempts:
-            result = subprocess.run(
-                [
-                    "ssh",
-                    "-i",
-                    self.home + "micado_cli_config_priv_key",
-                    "ubuntu@" + ip,
-                    "ls -lah",
-                ],
-                shell=False,
-                stdin=None,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=False,
-            )
-            if result.returncode == 0:
-                logger.debug("SSH connection available...")
-                break
-            logger.debug(result.stderr.decode())
-            attempts += 1
-            logger.debug(
-                "attempts:{}/{} Cloud-init still running. Try again {} second later".format(
-                    attempts + 1, max_attempts, sleep_time
-                )
-            )
-            time.sleep(sleep_time)
+            MicadoException: When timeout reached
 
-        if attempts == max_attempts:
-            raise Exception(
-                "{} second passed, and still cannot reach SSH.".format(
-                    attempts * sleep_time
-                )
-            )
+        Returns:
+            SSHSession: The open session, to be reused by later steps
+        """
+        ssh = SSHSession(ip, "ubuntu", self.home + "micado_cli_config_priv_key")
+        ssh.open()
+        try:
+            host_keys = ssh.host_keys()
+            if host_keys:
+                update_known_host(ip, host_keys)
+            else:
+                logger.debug(f"No new host key for {ip}, known_hosts unchanged")
+        except Exception:
+            ssh.close()
+            raise
+        return ssh
@@ -0,0 +1,194 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tarfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+
+from micado.utils.files import atomic_write, file_lock
+
+DEFAULT_CACHE = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "micado"
+CACHE_DIR = Path(os.environ.get("MICADO_CACHE_DIR", DEFAULT_CACHE))
+DOWNLOAD_URL = "https://github.com/micado-scale/ansible-micado/tarball/{version}"
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 60  # seconds to connect, and between received chunks
+
+logger = logging.getLogger(__name__)
+
+
+class TarballCache:
+    """Shared, content-addressed cache of ansible-micado tarballs
+
+    Tarballs are stored once as tarballs/<sha256>.tar.gz, and
+    versions/<version> records the checksum and size of each downloaded
+    version. Downloads are streamed, verified, installed atomically and
+    serialised per version with a lock file, so concurrent users download
+    only once. A cached tarball is only used if its content still matches
+    its checksum, otherwise it is downloaded again.
+
+    Args:
+        root (Path, optional): Cache directory. Defaults to CACHE_DIR.
+    """
+
+    def __init__(self, root: Path = CACHE_DIR):
+        self.root = Path(root)
+
+    def get(self, version: str) -> Path:
+        """Return the cached tarball of a version, downloading it if needed
+
+        Args:
+            version (string): ansible-micado version (git ref)
+
+        Raises:
+            TypeError: When the version cannot be downloaded
+
+        Returns:
+            Path: Location of the tarball in the cache
+        """
+        with self.stream(version) as stream:
+            stream.verify()
+        return stream.path
+
+    @contextmanager
+    def stream(self, version: str):
+        """Yield a binary stream of a version's tarball
+
+        A cached tarball is read from disk. Otherwise the HTTP body is
+        streamed through while being written to the cache, so the caller
+        can consume it in the same pass as the download. The download is
+        only trusted once the stream's verify() returns: it reads what the
+        caller left, checks the tarball and adds it to the cache. verify()
+        is called on leaving the block if the caller did not.
+
+        Args:
+            version (string): ansible-micado version (git ref)
+
+        Raises:
+            TypeError: When the version cannot be downloaded
+        """
+        if not version or "/" in version or version.startswith("."):
+            raise ValueError(f"Invalid MiCADO version: {version}")
+        for directory in ("tarballs", "versions"):
+            (self.root / directory).mkdir(parents=True, exist_ok=True)
+
+        with file_lock(self.root / "versions" / f".{version}.lock"):
+            cached = self._lookup(version)
+            if cached:
+                logger.debug(f"Using cached playbook {cached}")
+                with open(cached, "rb") as f:
+                    yield _TeeReader(f, path=cached)
+                return
+            with self._download(version) as stream:
+                yield stream
+                stream.verify()
+
+    def _lookup(self, version: str):
+        """Return the cached tarball of a version, or None if it is missing
+        or its content does not match the checksum it is named after
+        """
+        try:
+            digest = (self.root / "versions" / version).read_text().split()[0]
+        except (FileNotFoundError, IndexError):
+            return None
+        path = self.root / "tarballs" / f"{digest}.tar.gz"
+        try:
+            if file_digest(path) == digest:
+                return path
+        except FileNotFoundError:
+            return None
+        logger.warning(f"Cached playbook {path} is corrupt, downloading again...")
+        path.unlink()
+        return None
+
+    @contextmanager
+    def _download(self, version: str):
+        url = DOWNLOAD_URL.format(version=version)
+        logger.info(f"Downloading playbook {version}...")
+        tmp_path = self.root / "tarballs" / f".{version}.part"
+        try:
+            with requests.get(url, stream=True, timeout=TIMEOUT) as r:
+                if r.status_code != 200:
+                    raise TypeError(f"Download failed - check MiCADO {version} exists.")
+                r.raw.decode_content = True
+                with open(tmp_path, "wb") as f:
+                    stream = _TeeReader(r.raw, sink=f)
+                    stream.verify = lambda: self._install(version, stream, tmp_path)
+                    yield stream
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _install(self, version: str, stream, tmp_path: Path):
+        """Finish and check a download, then add it to the cache"""
+        if stream.path:
+            return
+        stream.drain()
+        stream.sink.flush()
+        os.fsync(stream.sink.fileno())
+        if not tarfile.is_tarfile(tmp_path):
+            raise TypeError(f"Download failed - check MiCADO {version} exists.")
+
+        digest = stream.digest.hexdigest()
+        if file_digest(tmp_path) != digest:
+            raise TypeError(f"Download failed - {version} was not written intact.")
+        path = self.root / "tarballs" / f"{digest}.tar.gz"
+        os.replace(tmp_path, path)
+        with atomic_write(self.root / "versions" / version, perms=0o644) as f:
+            f.write(f"{digest} {stream.size}")
+        stream.path = path
+
+
+class _TeeReader(io.RawIOBase):
+    """Reads a source stream, hashing it and copying it to an optional sink"""
+
+    def __init__(self, source, sink=None, path: Path = None):
+        self.source = source
+        self.sink = sink
+        self.path = path
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        self.digest.update(data)
+        self.size += len(data)
+        if self.sink:
+            self.sink.write(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+    def drain(self):
+        """Consume whatever the reader of the stream left unread"""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def verify(self):
+        """Nothing to check, a cached tarball was checked when looked up"""
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 of a file, reading it in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path):
+    """Hardlink src to dst, copying instead across filesystems"""
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
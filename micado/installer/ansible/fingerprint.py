@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from micado.utils.files import atomic_write
+
+FULL_RUN = None  # inputs mapped to this need the whole playbook
+AUTH_TAGS = "update-auth"  # re-apply cloud and registry credentials only
+
+logger = logging.getLogger(__name__)
+
+
+class Fingerprints:
+    """Fingerprints of the playbook inputs at the last successful run
+
+    Used to re-run only the tags affected by changed inputs. Inputs are
+    mapped to the tags which apply them, or to FULL_RUN when any change
+    needs the whole playbook:
+
+        >>> fingerprints = Fingerprints(path, {"cloud": "update-auth"})
+        >>> tags = fingerprints.changed_tags(current)
+        >>> ...  # run the playbook with tags, if needed
+        >>> fingerprints.save(current, tags)
+
+    Only hashes are stored, never the inputs themselves.
+
+    Args:
+        path (Path): JSON file holding the fingerprints
+        input_tags (dict): Tags by input name. Unlisted inputs are FULL_RUN.
+    """
+
+    def __init__(self, path: Path, input_tags: dict = None):
+        self.path = Path(path)
+        self.input_tags = input_tags or {}
+
+    def load(self) -> dict:
+        """Return the stored fingerprints, by input name"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def changed_tags(self, current: dict, full: bool = False):
+        """Return the tags to run for the inputs which changed
+
+        Args:
+            current (dict): Current fingerprints, by input name
+            full (bool, optional): Force a full run. Defaults to False.
+
+        Returns:
+            set: Tags to run. Empty when nothing changed, or FULL_RUN
+        """
+        previous = self.load()
+        if full or not previous:
+            return FULL_RUN
+
+        tags = set()
+        for name in sorted(set(previous) | set(current)):
+            if previous.get(name) == current.get(name):
+                continue
+            tag = self.input_tags.get(name, FULL_RUN)
+            logger.debug(f"Input {name} changed, needs {tag or 'a full run'}")
+            if tag is FULL_RUN:
+                return FULL_RUN
+            tags.add(tag)
+        return tags
+
+    def save(self, current: dict, tags=FULL_RUN):
+        """Store the fingerprints of the inputs applied by a successful run
+
+        Args:
+            current (dict): Current fingerprints, by input name
+            tags (set, optional): Tags that were run. Defaults to FULL_RUN.
+        """
+        fingerprints = current
+        if tags is not FULL_RUN:
+            fingerprints = self.load()
+            for name, tag in self.input_tags.items():
+                if tag in tags and name in current:
+                    fingerprints[name] = current[name]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(fingerprints, f, indent=2, sort_keys=True)
+
+
+def fingerprint_data(data, ignore=()) -> str:
+    """Return the sha256 of JSON-serialisable data, independent of key order
+
+    Args:
+        data: Data to fingerprint
+        ignore (tuple, optional): Keys to leave out, at any depth
+    """
+    dump = json.dumps(_without(data, ignore), sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+def fingerprint_file(path) -> str:
+    """Return the sha256 of a file's content, or None if it is missing"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def _without(data, ignore):
+    if isinstance(data, dict):
+        return {k: _without(v, ignore) for k, v in data.items() if k not in ignore}
+    if isinstance(data, (list, tuple)):
+        return [_without(v, ignore) for v in data]
+    return data
+
+
+def join_tags(tags) -> str:
+    """Format tags for Ansible, or None for a full run"""
+    return None if tags is FULL_RUN else ",".join(sorted(tags))
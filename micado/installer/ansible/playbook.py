@@ -1,15 +1,43 @@
+import errno
+import logging
 import os
+import posixpath
 import shutil
 import tarfile
+import tempfile
+import threading
+from concurrent.futures import Future
 from pathlib import Path
+from queue import Queue
 
 import ansible_runner
-import requests
+
+from micado.exceptions import MicadoException
+from micado.installer.ansible.cache import TarballCache, link_or_copy
+from micado.installer.ansible.progress import EventPipeline, ProgressReporter, TaskTimer
 
 PLAYBOOK_NAME = "micado.yml"
 PLAYBOOK_INTERNAL = "playbook"
 ROTATION = 100  # max number of artifacts (logs, etc...) to keep
 QUIET = True  # hide ansible output
+FACT_CACHE = "facts"  # fact cache directory, per run ID, in the home directory
+FACT_CACHE_TIMEOUT = 86400  # seconds
+RUNNER_STATUSES = ("successful", "failed", "timeout", "canceled")  # final statuses
+
+logger = logging.getLogger(__name__)
+
+# Opt-in settings which trade some generality for speed. The free strategy
+# drops the ordering of tasks across hosts, which the MiCADO playbook (a
+# single host) does not rely on.
+PERFORMANCE_PROFILE = {
+    "ANSIBLE_PIPELINING": "True",
+    "ANSIBLE_SSH_ARGS": "-C -o ControlMaster=auto -o ControlPersist=600s",
+    "ANSIBLE_STRATEGY": "free",
+    "ANSIBLE_GATHERING": "smart",
+    "ANSIBLE_GATHER_SUBSET": "!hardware,!facter,!ohai",
+    "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+    "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(FACT_CACHE_TIMEOUT),
+}
 
 
 class Playbook:
@@ -18,56 +46,163 @@ class Playbook:
         self.id: str = id
         self.tar_download: Path = Path(f"{home_dir}micado-{version}.tar.gz")
         self.playbook_path: Path = Path(f"{home_dir}micado-{version}")
+        self.fact_cache: Path = Path(f"{home_dir}{FACT_CACHE}") / id
+
+    def run(
+        self,
+        hosts: dict,
+        extravars: dict,
+        playbook: str = None,
+        tags: str = None,
+        forks: int = None,
+        accelerate: bool = False,
+        on_progress=None,
+    ):
+        """Run the playbook, optionally limited to a comma-separated list of tags
 
-    def run(self, hosts: dict, extravars: dict, playbook: str = None):
-        """Run the playbook"""
+        With accelerate, run with PERFORMANCE_PROFILE: SSH pipelining and
+        persistent connections, the free strategy, a reduced fact subset
+        and a jsonfile fact cache kept per run ID. The profile replaces
+        any ANSIBLE_SSH_ARGS of the environment. The free strategy lets
+        each host go through the tasks at its own pace, so a task may run
+        on one host before an earlier task has finished on another: only
+        the order of tasks on each host is kept.
+
+        on_progress is called with a TaskProgress as each task starts and
+        completes on each host. The duration of each task and role is
+        written to timings.json in the artifacts directory of the run.
+        """
         if not self.playbook_exists():
-            self.download()
-            self.extract()
-        
+            self.fetch()
+
+        kwargs, timer = self._runner_kwargs(
+            hosts, extravars, playbook, tags, forks, accelerate, on_progress
+        )
+        runner = ansible_runner.interface.run(**kwargs)
+        self._finish(runner, timer)
+        return runner
+
+    def run_async(
+        self,
+        hosts: dict,
+        extravars: dict,
+        playbook: str = None,
+        tags: str = None,
+        forks: int = None,
+        accelerate: bool = False,
+        on_progress=None,
+    ):
+        """Start the playbook in the background, as per run()
+
+        The playbook is fetched if needed and run on a background thread,
+        so many runs can be driven from a single process.
+
+            >>> job = playbook.run_async(hosts, extravars)
+            >>> for event in job.events():
+            ...     print(event["stdout"])
+            >>> runner = job.wait()
+
+        Returns:
+            PlaybookJob: Handle on the run
+        """
+        job = PlaybookJob(self.id)
+        thread = threading.Thread(
+            target=self._run_job,
+            args=(
+                job, hosts, extravars, playbook, tags, forks, accelerate, on_progress
+            ),
+            name=f"playbook-{self.id}",
+            daemon=True,
+        )
+        thread.start()
+        return job
+
+    def _run_job(
+        self, job, hosts, extravars, playbook, tags, forks, accelerate, on_progress
+    ):
+        try:
+            if not self.playbook_exists():
+                self.fetch()
+            kwargs, timer = self._runner_kwargs(
+                hosts, extravars, playbook, tags, forks, accelerate, on_progress,
+                job._put,
+            )
+            thread, job.runner = ansible_runner.interface.run_async(
+                cancel_callback=job.cancelled, **kwargs
+            )
+            thread.join()
+            self._finish(job.runner, timer)
+            if job.runner.status not in RUNNER_STATUSES:
+                raise MicadoException(f"Playbook run {self.id} errored")
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(job.runner)
+        finally:
+            job._put(None)
+
+    def _runner_kwargs(
+        self, hosts, extravars, playbook, tags, forks, accelerate, on_progress,
+        *handlers,
+    ):
+        """Return the ansible-runner arguments of a run, and its TaskTimer"""
         data_dir = self.playbook_path / PLAYBOOK_INTERNAL
 
         # fix_hosts_permissions() because https://github.com/ansible/ansible-runner/issues/853
         fix_hosts_permissions(data_dir)
-        runner = ansible_runner.interface.run(
+        envvars = self.performance_envvars() if accelerate else None
+        timer = TaskTimer()
+        progress = ProgressReporter(on_progress) if on_progress else None
+        kwargs = dict(
             ident=self.id,
             playbook=playbook or PLAYBOOK_NAME,
             private_data_dir=str(data_dir),
             inventory=hosts,
             extravars=extravars,
+            tags=tags,
+            forks=forks,
+            envvars=envvars,
+            event_handler=EventPipeline(timer, progress, *handlers),
             rotate_artifacts=ROTATION,
             quiet=QUIET,
         )
-        fix_hosts_permissions(data_dir)
-        return runner
+        return kwargs, timer
 
-    def download(self):
-        """Download playbook from GitHub and write down to home directory."""
-        url = f"https://github.com/micado-scale/ansible-micado/tarball/{self.version}"
-        r = requests.get(url, stream=True)
+    def _finish(self, runner, timer):
+        fix_hosts_permissions(self.playbook_path / PLAYBOOK_INTERNAL)
+        report = timer.write(runner.config.artifact_dir)
+        logger.debug(f"Playbook timings written to {report}")
 
-        with open(self.tar_download, "wb") as f:
-            f.write(r.content)
+    def performance_envvars(self) -> dict:
+        """Ansible environment for the performance profile"""
+        self.fact_cache.mkdir(parents=True, exist_ok=True)
+        envvars = dict(PERFORMANCE_PROFILE)
+        envvars["ANSIBLE_CACHE_PLUGIN_CONNECTION"] = str(self.fact_cache)
+        return envvars
 
-        if not tarfile.is_tarfile(self.tar_download):
-            os.remove(self.tar_download)
-            raise TypeError(f"Download failed - check MiCADO {self.version} exists.")
+    def fetch(self):
+        """Stream-extract the playbook into place in a single pass, from the
+        shared cache or straight from the GitHub response. A download is
+        verified before the playbook is put in place."""
+        with TarballCache().stream(self.version) as stream:
+            try:
+                extract_stream(stream, self.playbook_path, verify=stream.verify)
+            except tarfile.ReadError:
+                raise TypeError(f"Download failed - check MiCADO {self.version} exists.")
+
+    def download(self):
+        """Link the playbook tarball into the home directory from the shared
+        cache, which downloads it from GitHub only once per version."""
+        tarball = TarballCache().get(self.version)
+        link_or_copy(tarball, self.tar_download)
 
     def extract(self):
         """Extract tar to the directory where it was downloaded"""
         if not os.path.isfile(self.tar_download):
             raise FileNotFoundError("Playbook tarball not found. Cannot extract.")
 
-        tar_file = tarfile.open(self.tar_download)
-        tar_path = self.tar_download.parent / tar_file.firstmember.name
-        tar_file.extractall(self.tar_download.parent)
-        tar_file.close()
-
-        # Don't overwrite an existing playbook of the same version
-        try:
-            tar_path.rename(self.playbook_path)
-        except OSError:
-            shutil.rmtree(str(tar_path))
+        with open(self.tar_download, "rb") as f:
+            extract_stream(f, self.playbook_path)
 
         self.tar_download.unlink()  # delete the tarball
 
@@ -82,8 +217,149 @@ class Playbook:
         """Check if playbook directory exists"""
         return os.path.isdir(self.playbook_path)
 
+class PlaybookJob:
+    """Handle on a playbook started with Playbook.run_async()
+
+    The runner is available from future, a concurrent.futures.Future,
+    once the run ends. Use asyncio.wrap_future(job.future) to await it.
+
+    Args:
+        id (string): Run ID
+    """
+
+    def __init__(self, id: str):
+        self.id = id
+        self.runner = None
+        self.future = Future()
+        self._cancel = threading.Event()
+        self._events = Queue()
+
+    @property
+    def status(self) -> str:
+        """ansible-runner status of the run, "pending" until it starts"""
+        if self.future.done() and self.future.exception():
+            return "error"
+        return self.runner.status if self.runner else "pending"
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self):
+        """Ask the run to stop, which ends it with the canceled status"""
+        self._cancel.set()
+
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def wait(self, timeout: float = None):
+        """Block until the run ends, and return the runner
+
+        Raises:
+            concurrent.futures.TimeoutError: When the run is still going
+            Exception: What prevented the run from completing
+        """
+        return self.future.result(timeout)
+
+    def events(self):
+        """Yield the ansible-runner events as they come, until the run ends
+
+        Events are queued from the start of the run, and can be consumed
+        only once.
+        """
+        while True:
+            event = self._events.get()
+            if event is None:
+                self._events.put(None)  # let any later call end at once
+                return
+            yield event
+
+    def _put(self, event):
+        self._events.put(event)
+
+
 def fix_hosts_permissions(path: Path):
     try:
         os.chmod(path / "inventory/hosts.json", 0o600)
     except FileNotFoundError:
-        pass
\ No newline at end of file
+        pass
+
+def extract_stream(fileobj, target: Path, verify=None):
+    """Extract a GitHub tar.gz stream into target, in one sequential pass
+
+    The top-level directory of the archive is stripped. Members which
+    would land or link outside target, and members which are not regular
+    files, directories or links, are skipped. The archive is extracted
+    into a temporary sibling directory which is then renamed to target.
+    An existing target is left untouched.
+
+    Args:
+        fileobj: Binary stream of the archive
+        target (Path): Directory to extract into
+        verify (callable, optional): Called once the archive is extracted,
+            before target is put in place. Raise to discard the extraction.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=target.parent, prefix=f".{target.name}.")
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                name = _strip_top_level(member.name)
+                if not name:
+                    continue
+                if member.issym() or member.islnk():
+                    linkname = _link_target(name, member)
+                    if not linkname:
+                        logger.debug(f"Skipping {member.name}: links outside the tree")
+                        continue
+                    member.linkname = linkname
+                elif not (member.isfile() or member.isdir()):
+                    logger.debug(f"Skipping {member.name}: not a file or directory")
+                    continue
+                member.name = name
+                member.mode = (member.mode | 0o600) & 0o755
+                tar.extract(member, tmp_dir, **_EXTRACT_KWARGS)
+        if verify:
+            verify()
+        os.chmod(tmp_dir, 0o755)
+        try:
+            os.rename(tmp_dir, target)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            # don't overwrite an existing playbook of the same version
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _link_target(name: str, member: tarfile.TarInfo):
+    """Return the link target of a member as extracted, or None if it
+    points outside the extraction directory
+
+    Symlinks are relative to their own directory, and hard links are
+    archive paths, which lose their top-level directory too.
+    """
+    if member.islnk():
+        return _strip_top_level(member.linkname)
+    linkname = member.linkname
+    if linkname.startswith("/"):
+        return None
+    resolved = posixpath.normpath(posixpath.join(posixpath.dirname(name), linkname))
+    if resolved == ".." or resolved.startswith("../"):
+        return None
+    return linkname
+
+
+def _strip_top_level(name: str):
+    """Return the member path without its top-level directory, or None if
+    the path is empty or escapes the extraction directory"""
+    if name.startswith("/") or ".." in name.split("/"):
+        return None
+    parts = posixpath.normpath(name).split("/")[1:]
+    if not parts:
+        return None
+    return "/".join(parts)
+
+
+# Python 3.12+ can double check each member with the "data" filter
+_EXTRACT_KWARGS = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
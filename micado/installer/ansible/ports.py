@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from micado.exceptions import MicadoException
+
+PORT_TIMEOUT = 2000  # seconds to wait for all ports to open
+CONNECT_TIMEOUT = 2  # seconds allowed for each connection attempt
+RETRY_FIRST = 0.5  # seconds before the first retry
+RETRY_FACTOR = 1.5
+RETRY_MAX = 5
+
+logger = logging.getLogger(__name__)
+
+
+async def probe_port(ip: str, port: int, timeout: float = PORT_TIMEOUT) -> float:
+    """Wait until a TCP port accepts connections
+
+    Retries with a growing delay, without touching global socket state.
+
+    Returns:
+        float: Seconds it took for the port to open
+
+    Raises:
+        MicadoException: When the port is still closed after timeout
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout
+    delay = RETRY_FIRST
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, port), CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as error:
+            logger.debug(f"{ip}:{port} attempt {attempts} failed: {error!r}")
+        else:
+            writer.close()
+            elapsed = loop.time() - start
+            logger.info(f"{port} port is available after {elapsed:.1f}s...")
+            return elapsed
+
+        if loop.time() + delay > deadline:
+            raise MicadoException(
+                f"{timeout} seconds passed, and still cannot reach {port}."
+            )
+        await asyncio.sleep(delay)
+        delay = min(delay * RETRY_FACTOR, RETRY_MAX)
+
+
+async def probe_ports(ip: str, ports, timeout: float = PORT_TIMEOUT) -> dict:
+    """Wait until several TCP ports accept connections, concurrently
+
+    Returns:
+        dict: Seconds it took for each port to open, by port
+    """
+    times = await asyncio.gather(*(probe_port(ip, port, timeout) for port in ports))
+    return dict(zip(ports, times))
+
+
+def wait_for_ports(ip: str, ports, timeout: float = PORT_TIMEOUT) -> dict:
+    """Blocking wrapper of probe_ports, safe to call inside a running loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(probe_ports(ip, ports, timeout))
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, probe_ports(ip, ports, timeout)).result()
@@ -0,0 +1,150 @@
+import json
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+from micado.utils.files import atomic_write
+
+TIMING_REPORT = "timings.json"  # written to the artifacts directory of each run
+RESULT_EVENTS = {
+    "runner_on_ok": "ok",
+    "runner_on_failed": "failed",
+    "runner_on_skipped": "skipped",
+    "runner_on_unreachable": "unreachable",
+}
+START_EVENTS = ("playbook_on_task_start", "playbook_on_handler_task_start")
+FAILED = ("failed", "unreachable")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaskProgress:
+    """Progress of a playbook task, as passed to progress callbacks"""
+
+    task: str
+    role: str
+    status: str  # started, ok, changed, failed, skipped or unreachable
+    host: str = None
+    duration: float = None
+    message: str = None
+
+
+class EventPipeline:
+    """ansible-runner event_handler passing each event to several handlers
+
+    Args:
+        handlers (callable): Called with each event dict, in order
+    """
+
+    def __init__(self, *handlers):
+        self.handlers = [handler for handler in handlers if handler]
+
+    def __call__(self, event: dict) -> bool:
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Playbook event handler failed")
+        return True  # keep the event in runner.events
+
+
+class ProgressReporter:
+    """Event handler passing task progress to a callback
+
+    Args:
+        callback (callable): Called with a TaskProgress for each task start
+            and each per-host result
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self, event: dict):
+        name = event.get("event")
+        data = event.get("event_data", {})
+        if name in START_EVENTS:
+            status = "started"
+        elif name in RESULT_EVENTS:
+            status = RESULT_EVENTS[name]
+            if status == "ok" and data.get("res", {}).get("changed"):
+                status = "changed"
+        else:
+            return
+        self.callback(
+            TaskProgress(
+                task=data.get("task", ""),
+                role=data.get("role", ""),
+                status=status,
+                host=data.get("host"),
+                duration=data.get("duration"),
+                message=_result_message(data) if status in FAILED else None,
+            )
+        )
+
+
+class TaskTimer:
+    """Event handler collecting the duration of each task and role
+
+    A task takes as long as its slowest host, and a role as long as the
+    sum of its tasks.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def __call__(self, event: dict):
+        if event.get("event") not in RESULT_EVENTS:
+            return
+        data = event.get("event_data", {})
+        key = data.get("task_uuid") or (data.get("role", ""), data.get("task", ""))
+        task = self.tasks.setdefault(
+            key,
+            {
+                "task": data.get("task", ""),
+                "role": data.get("role", ""),
+                "duration": 0.0,
+                "hosts": 0,
+            },
+        )
+        task["duration"] = max(task["duration"], data.get("duration") or 0.0)
+        task["hosts"] += 1
+
+    def report(self) -> dict:
+        """Return task and role durations, slowest first"""
+        roles = {}
+        for task in self.tasks.values():
+            roles[task["role"]] = roles.get(task["role"], 0.0) + task["duration"]
+        return {
+            "total": sum(roles.values()),
+            "roles": [
+                {"role": role, "duration": duration}
+                for role, duration in sorted(roles.items(), key=lambda i: -i[1])
+            ],
+            "tasks": sorted(self.tasks.values(), key=lambda i: -i["duration"]),
+        }
+
+    def write(self, artifact_dir) -> Path:
+        """Write the report as TIMING_REPORT in the run's artifacts directory"""
+        path = Path(artifact_dir) / TIMING_REPORT
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(path, perms=0o644) as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+def failure_summary(events) -> str:
+    """Describe the failed tasks of a run, one line per host and task"""
+    lines = []
+    for event in events:
+        status = RESULT_EVENTS.get(event.get("event"))
+        data = event.get("event_data", {})
+        if status not in FAILED or data.get("ignore_errors"):
+            continue
+        lines.append(f"{data.get('host')}: {data.get('task')}: {_result_message(data)}")
+    return "\n".join(lines)
+
+
+def _result_message(data: dict) -> str:
+    res = data.get("res") or {}
+    return str(res.get("msg") or res.get("stderr") or res.get("reason") or "").strip()
@@ -0,0 +1,199 @@
+import base64
+import hashlib
+import hmac
+import logging
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from micado.exceptions import MicadoException
+from micado.utils.files import atomic_write, file_lock
+
+CONTROL_PERSIST = "10m"  # keep the master alive between commands
+OPEN_ATTEMPTS = 100
+OPEN_SLEEP = 2  # seconds between attempts to open the master connection
+KNOWN_HOSTS = Path.home() / ".ssh" / "known_hosts"
+
+logger = logging.getLogger(__name__)
+
+
+class SSHSession:
+    """A persistent OpenSSH master connection to a MiCADO VM
+
+    Opened once, then reused through its ControlPath by commands, file
+    transfers and Ansible, so each of them skips the SSH handshake.
+
+        >>> with SSHSession(ip, "ubuntu", key_file) as ssh:
+        ...     ssh.run("ls -lah")
+
+    Args:
+        ip (string): Target IP
+        user (string): Remote user
+        key_file (string): Path to the private key
+    """
+
+    def __init__(self, ip: str, user: str, key_file: str):
+        self.ip = ip
+        self.user = user
+        self.key_file = key_file
+        self._control_dir = tempfile.mkdtemp(prefix="micado-ssh-")
+        self.control_path = str(Path(self._control_dir) / "cm")
+        self.known_hosts = str(Path(self._control_dir) / "known_hosts")
+        self.is_open = False
+
+    def __enter__(self):
+        if not self.is_open:
+            self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def target(self) -> str:
+        return f"{self.user}@{self.ip}"
+
+    @property
+    def options(self) -> list:
+        """Options that route an ssh/scp/sftp command through the master"""
+        return self._options("auto")
+
+    def _options(self, control_master: str) -> list:
+        return [
+            "-o", f"ControlPath={self.control_path}",
+            "-o", f"ControlMaster={control_master}",
+            "-o", f"ControlPersist={CONTROL_PERSIST}",
+            "-o", "BatchMode=yes",
+            "-o", f"UserKnownHostsFile={self.known_hosts}",
+            "-o", "StrictHostKeyChecking=accept-new",
+            "-i", self.key_file,
+        ]
+
+    @property
+    def ansible_ssh_args(self) -> str:
+        """Value for ansible_ssh_common_args, so Ansible reuses the master"""
+        return " ".join(self.options[:-2])
+
+    def open(self, attempts: int = OPEN_ATTEMPTS, sleep_time: float = OPEN_SLEEP):
+        """Start the master connection, retrying until the VM accepts the key
+
+        The master stays in the background, so it must not hold pipes the
+        call waits on: its output goes to /dev/null and a temporary file.
+
+        Raises:
+            MicadoException: When the VM does not accept the connection
+        """
+        for attempt in range(1, attempts + 1):
+            with tempfile.TemporaryFile() as stderr:
+                result = subprocess.run(
+                    ["ssh", *self._options("yes"), "-fN", self.target],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                    check=False,
+                )
+                if result.returncode == 0:
+                    logger.debug("SSH connection available...")
+                    self.is_open = True
+                    return self
+                stderr.seek(0)
+                logger.debug(stderr.read().decode(errors="replace"))
+            logger.debug(
+                "attempts:{}/{} Cloud-init still running. Try again {} second later".format(
+                    attempt, attempts, sleep_time
+                )
+            )
+            time.sleep(sleep_time)
+
+        self.close()
+        raise MicadoException(
+            "{} second passed, and still cannot reach SSH.".format(attempts * sleep_time)
+        )
+
+    def host_keys(self) -> list:
+        """Known_hosts lines for the host key accepted by the master"""
+        try:
+            with open(self.known_hosts) as f:
+                return [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def run(self, command: str, check: bool = True) -> subprocess.CompletedProcess:
+        """Run a command on the VM over the master connection"""
+        return subprocess.run(
+            ["ssh", *self.options, self.target, command],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=check,
+        )
+
+    def get(self, remote_path: str, local_path: str):
+        """Copy a file from the VM over the master connection"""
+        result = self.run(f"cat {shlex.quote(remote_path)}")
+        with open(local_path, "wb") as f:
+            f.write(result.stdout)
+
+    def close(self):
+        """Stop the master connection"""
+        if self.is_open:
+            subprocess.run(
+                ["ssh", "-o", f"ControlPath={self.control_path}", "-O", "exit", self.target],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=False,
+            )
+            self.is_open = False
+        shutil.rmtree(self._control_dir, ignore_errors=True)
+
+
+def update_known_host(host: str, entries: list, path: Path = KNOWN_HOSTS):
+    """Replace the known_hosts entries of a single host
+
+    Other entries are kept. The file is rewritten atomically, under a lock
+    so that concurrent deploys do not lose each other's updates.
+
+    Args:
+        host (string): Hostname or IP, as written in known_hosts
+        entries (list): New known_hosts lines for the host
+        path (Path, optional): known_hosts file. Defaults to ~/.ssh/known_hosts
+    """
+    path = Path(path)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    with file_lock(f"{path}.lock"):
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+
+        kept = [line for line in lines if not _is_entry_for(line, host)]
+        if kept and not kept[-1].endswith("\n"):
+            kept[-1] += "\n"
+        kept += [line if line.endswith("\n") else line + "\n" for line in entries]
+
+        with atomic_write(path, perms=0o600) as f:
+            f.writelines(kept)
+
+
+def _is_entry_for(line: str, host: str) -> bool:
+    """Whether a known_hosts line is a plain key entry for the host"""
+    fields = line.split()
+    if not fields or fields[0].startswith(("#", "@")):
+        return False
+    return any(_matches(pattern, host) for pattern in fields[0].split(","))
+
+
+def _matches(pattern: str, host: str) -> bool:
+    if not pattern.startswith("|1|"):
+        return pattern == host
+    try:
+        salt, digest = pattern.split("|")[2:4]
+        mac = hmac.new(base64.b64decode(salt), host.encode(), hashlib.sha1)
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(base64.b64encode(mac.digest()).decode(), digest)
@@ -3,23 +3,26 @@
 import logging
 import logging.config
 import os
+import re
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from urllib.parse import urlparse
-from time import sleep
+from time import monotonic, sleep
 import itertools as it
-import xml.dom.minidom
-from xml.dom.minidom import parseString
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element, SubElement, tostring
+import io
 import xml.etree.ElementTree as ET
-from dicttoxml import dicttoxml
+from dataclasses import dataclass
 from collections import OrderedDict
 import requests, json
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
 import base64
 from micado.types.micado import MicadoInfo
 from micado.exceptions import MicadoException
-from micado.utils.utils import DataHandling, SSHKeyHandling
+from micado.utils.utils import DataHandling, SSHKeyHandling, seconds_since
 import ruamel.yaml as yaml
 
 """
@@ -27,6 +30,15 @@ Low-level methods for handling a MiCADO node with CloudBroker API
 """
 DEFAULT_PATH = Path.home() / ".micado-cli"
 DEFAULT_VERS = "0.9.1-rev1"
+MICADO_NAME = re.compile(r"^MiCADO-[0-9a-f]{32}$")
+STOPPED_STATES = ("stopping", "stopped")
+FAILED_STATES = ("failed", "error") + STOPPED_STATES
+DELETE_WORKERS = 8
+SWEEP_MIN_AGE = 3600  # seconds before an unrecorded MiCADO VM counts as orphaned
+LAUNCH_TIMEOUT = 900  # seconds to wait for a new instance to be running
+POLL_FIRST = 1  # seconds before the first status poll
+POLL_FACTOR = 1.5
+POLL_MAX = 15
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -48,11 +60,219 @@ logger.addHandler(ch)
 logger.addHandler(fh)
 
 
+@dataclass
+class InstanceInfo:
+    """The fields of a CloudBroker instance document used by the launcher."""
+    id: str
+    status: str = ""
+    ip: str = ""
+    name: str = ""
+    created: str = ""
+
+
+def _instance_info(element):
+    return InstanceInfo(
+        id=element.findtext('id', ''),
+        status=element.findtext('status', ''),
+        ip=element.findtext('external-ip-address', ''),
+        name=element.findtext('name', ''),
+        created=element.findtext('created-at', ''),
+    )
+
+
+def parse_instance(text):
+    """Decode a single <instance> document into an InstanceInfo."""
+    return _instance_info(ET.fromstring(text))
+
+
+def parse_instances(text):
+    """Decode an <instances> collection, one InstanceInfo at a time."""
+    depth = 0
+    for event, element in ET.iterparse(io.StringIO(text), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and element.tag == 'instance':
+            yield _instance_info(element)
+            element.clear()
+
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8" ?>'
+XML_ESCAPES = str.maketrans({
+    "&": "&amp;", '"': "&quot;", "'": "&apos;", "<": "&lt;", ">": "&gt;"})
+
+
+def _xml_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).translate(XML_ESCAPES)
+
+
+def instance_xml(descr):
+    """Serialise an instance description into the <instance> request body.
+
+    Produces the same bytes as dicttoxml(descr, custom_root='instance',
+    attr_type=False) for the flat string/number descriptions used here.
+    """
+    body = "".join(
+        "<{0}>{1}</{0}>".format(key, _xml_text(value)) for key, value in descr.items())
+    return XML_DECLARATION + "<instance>{}</instance>".format(body).encode("utf-8")
+
+
+class _Waiter:
+    """Polling schedule and pending status updates of one instance."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.interval = POLL_FIRST
+        self.next_poll = monotonic() + POLL_FIRST
+        self.updates = []
+
+
+class InstanceTracker:
+    """
+    Tracks every instance being waited on at a CloudBroker endpoint from
+    a single polling thread. A lone instance is polled directly, several
+    are polled with one request to the /instances.xml collection, filtered
+    to their IDs, so the request rate stays flat however many launches are
+    waiting.
+    """
+
+    def __init__(self, launcher, auth_url):
+        self.launcher = launcher
+        self.auth_url = auth_url
+        self._waiters = {}
+        self._cond = threading.Condition()
+        self._poller = None
+
+    def wait(self, instanceid, timeout=LAUNCH_TIMEOUT, on_status=None):
+        """
+        Block until the instance is running. See
+        CloudBrokerLauncher.wait_for_instance for the arguments.
+        """
+        waiter = _Waiter(monotonic() + timeout)
+        with self._cond:
+            self._waiters[instanceid] = waiter
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+                self._poller.start()
+            self._cond.notify_all()
+        try:
+            return self._wait(instanceid, waiter, timeout, on_status)
+        finally:
+            with self._cond:
+                self._waiters.pop(instanceid, None)
+                self._cond.notify_all()
+
+    def _wait(self, instanceid, waiter, timeout, on_status):
+        mstate = None
+        while True:
+            with self._cond:
+                while not waiter.updates and monotonic() < waiter.deadline:
+                    self._cond.wait(waiter.deadline - monotonic())
+                updates, waiter.updates = waiter.updates, []
+            for instance in updates:
+                if instance.status != mstate:
+                    logger.info('CloudBroker instance %s is %s', instanceid, instance.status)
+                    if on_status:
+                        on_status(instanceid, mstate, instance.status)
+                    mstate = instance.status
+                if mstate == "running":
+                    return instance
+                if mstate in FAILED_STATES:
+                    raise MicadoException(
+                        'CloudBroker instance {0} is {1}.'.format(instanceid, mstate))
+            if monotonic() >= waiter.deadline:
+                raise MicadoException(
+                    'CloudBroker instance {0} not running after {1} seconds (last status: {2}).'.format(
+                        instanceid, timeout, mstate))
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._waiters:
+                        self._poller = None
+                        return
+                    delay = min(w.next_poll for w in self._waiters.values()) - monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                ids = list(self._waiters)
+            instances = self._poll(ids)
+            with self._cond:
+                now = monotonic()
+                for id in ids:
+                    waiter = self._waiters.get(id)
+                    if waiter is None:
+                        continue
+                    if id in instances:
+                        waiter.updates.append(instances[id])
+                    # every waiter was just polled, so they stay in step
+                    if waiter.next_poll <= now:
+                        waiter.interval = min(waiter.interval * POLL_FACTOR, POLL_MAX)
+                    waiter.next_poll = now + waiter.interval
+                self._cond.notify_all()
+
+    def _poll(self, ids):
+        """Return the current InstanceInfo of the given instances by ID."""
+        try:
+            if len(ids) == 1:
+                return {ids[0]: self.launcher.get_instance(self.auth_url, ids[0], attempts=1)}
+            query_str = self.auth_url + '/instances.xml'
+            r = self.launcher.session.get(query_str, params={'id': ','.join(ids)})
+            if r.status_code != 200:
+                logger.debug('CloudBroker API call failed! query: %s, status code %d, response: %s', query_str, r.status_code, r.text)
+                return {}
+            wanted = set(ids)
+            return {i.id: i for i in parse_instances(r.text) if i.id in wanted}
+        except Exception as e:
+            logger.debug('Polling CloudBroker instances %s failed: %s', ids, e)
+            return {}
+
+
+class _CredentialAuth(AuthBase):
+    """Basic auth with the launcher's current CloudBroker credentials."""
+
+    def __init__(self, launcher):
+        self.launcher = launcher
+
+    def __call__(self, r):
+        return HTTPBasicAuth(*self.launcher.get_auth())(r)
+
+
 class CloudBrokerLauncher:
     """
     For launching a MiCADO node with CloudBroker API
     """
     home = str(Path(os.environ.get("MICADO_CLI_DIR", DEFAULT_PATH))) + '/'
+    supports_snapshot = False  # whether snapshot() can bake images
+
+    def __init__(self):
+        self._session = None
+        self._auth = None
+        self._auth_mtime = None
+        self._trackers = {}
+        self._trackers_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        Keep-alive session shared by every API call of this launcher,
+        authenticated with the (cached) CloudBroker credentials as each
+        request is built.
+        """
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=DELETE_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.auth = _CredentialAuth(self)
+            self._session = session
+        return self._session
 
     def launch(self, 
                auth_url, 
@@ -61,6 +281,8 @@ class CloudBrokerLauncher:
                instance_type_id=None, 
                key_pair_id=None, 
                firewall_rule_set_id=None, 
+               launch_timeout=LAUNCH_TIMEOUT,
+               on_status=None,
                **kwargs):
         """
         Create the MiCADO node
@@ -72,6 +294,10 @@ class CloudBrokerLauncher:
             instance_type_id ([type]): [description]
             key_pair_id ([type]): [description]
             firewall_rule_set_id ([type]): [description]
+            launch_timeout (int, optional): Seconds to wait for the
+                instance to be running. Defaults to LAUNCH_TIMEOUT.
+            on_status (callable, optional): Called with the instance id,
+                the previous and the new status on every status change
 
         Returns:
             MicadoInfo: Dataclass with MiCADO ID and IP
@@ -112,24 +338,18 @@ class CloudBrokerLauncher:
             descr['cloud-init'] = base64.b64encode(cloud_init_config.encode('utf-8')).decode('utf-8')
             descr['cloud-init-b64'] = 'true'
 
-            logger.debug("XML to pass to CloudBroker: %s", dicttoxml(descr, custom_root='instance', attr_type=False))
-            r = requests.post(auth_url + '/instances.xml',
-                              dicttoxml(descr, custom_root='instance', attr_type=False),
-                              auth=self.get_auth(),
+            body = instance_xml(descr)
+            logger.debug("XML to pass to CloudBroker: %s", body)
+            r = self.session.post(auth_url + '/instances.xml',
+                              body,
                               headers={'Content-Type': 'application/xml'})            
 
             logger.debug('CloudBroker instance create response status code %d, response: %s', r.status_code, r.text)
             if (r.status_code == 201):
-                DOMTree = xml.dom.minidom.parseString(r.text)
-                instance = DOMTree.documentElement
-                instanceID = instance.getElementsByTagName('id')[0].childNodes[0].data
+                instanceID = parse_instance(r.text).id
                 logger.info("CloudBroker instance started, instance id: %s", instanceID)
-                mstate = "starting"
-                while mstate != "running":
-                    sleep(5)
-                    instance = self.get_instance(auth_url, instanceID)
-                    mstate = self.getTagText(instance.getElementsByTagName('status').item(0).childNodes)
-                floating_ip_address = self.getTagText(instance.getElementsByTagName('external-ip-address').item(0).childNodes)
+                instance = self.wait_for_instance(auth_url, instanceID, launch_timeout, on_status)
+                floating_ip_address = instance.ip
                 self._persist_data(floating_ip_address, instanceID, auth_url, deployment_id, instance_type_id, key_pair_id, firewall_rule_set_id)
                 return MicadoInfo(instanceID, floating_ip_address)
             else:
@@ -139,9 +359,13 @@ class CloudBrokerLauncher:
 
         except MicadoException as e:
             logger.error(f"Exception cought: {e}")
+            if instanceID:
+                self._stop_instances(auth_url, [instanceID])
             raise
         except Exception as e:
             logger.error(f"Exception cought: {e}")
+            if instanceID:
+                self._stop_instances(auth_url, [instanceID])
             raise
 
     def delete(self, id):
@@ -154,22 +378,14 @@ class CloudBrokerLauncher:
         """
         try:
             auth_url = None
-            content = None
-            with open(self.home + 'data.yml', mode='r') as f:
-                content = yaml.safe_load(f)
-            search = [i for i in content["micados"] if i.get(id, None)]
-            if not search:
+            server = DataHandling.remove_data(self.home + 'data.yml', [id]).get(id)
+            if server is None:
                 logger.debug(
                     "This {} ID can not find in the data file.".format(id))
-                pass
             else:
-                logger.debug("Remove {} record".format(search))
-                auth_url = search[0][id]["auth_url"]
-                content["micados"].remove(search[0])
-                with open(self.home + 'data.yml', mode='w') as f:
-                    yaml.dump(content, f)
+                auth_url = server["auth_url"]
 
-            r = requests.put(auth_url + '/instances/' + id + '/stop.xml', auth=self.get_auth())
+            r = self.session.put(auth_url + '/instances/' + id + '/stop.xml')
             logger.info('Dropping node {}'.format(id))
             if os.path.isfile(self.home + id + '-ssl.pem'):
                 logger.info("remove {}-ssl.pem".format(self.home + id))
@@ -178,6 +394,122 @@ class CloudBrokerLauncher:
         except MicadoException as e:
             logger.error(f"Exception cought: {e}")
 
+    def delete_many(self, ids):
+        """
+        Destroy several existing MiCADO VMs concurrently, over one
+        pooled session, writing the data file once. IDs missing from the
+        data file are reported as not found, and the VMs which could not
+        be stopped stay recorded.
+        Args:
+            ids (list): The MiCADO UUIDs.
+        Returns:
+            dict: Result of each deletion, by MiCADO UUID
+        """
+        records = DataHandling.remove_data(self.home + 'data.yml', ids)
+        results = {}
+        endpoints = {}
+        for id in ids:
+            server = records.get(id)
+            if server is None:
+                logger.error(
+                    "This {} ID can not find in the data file.".format(id))
+                results[id] = "Not found"
+                continue
+            endpoints.setdefault(server["auth_url"], []).append(id)
+
+        for auth_url, endpoint_ids in endpoints.items():
+            try:
+                results.update(self._stop_instances(auth_url, endpoint_ids))
+            except Exception as e:
+                logger.error(f"Exception cought: {e}")
+                results.update({id: f"Failed: {e}" for id in endpoint_ids})
+        self._restore_failed(records, results)
+        return results
+
+    def sweep(self, auth_url, recorded=False, min_age=SWEEP_MIN_AGE):
+        """
+        Destroy orphaned MiCADO VMs on a CloudBroker endpoint.
+        Orphans are running instances named after the MiCADO naming scheme
+        (MiCADO-<uuid>) which are not recorded in the data file. An
+        instance is only recorded once it is running, so instances younger
+        than min_age are left alone, as another client may still be
+        launching them.
+        Args:
+            auth_url (string): CloudBroker API endpoint.
+            recorded (bool, optional): Also destroy the MiCADO VMs which
+                are recorded in the data file. Defaults to False.
+            min_age (int, optional): Seconds since an instance was created
+                before it can be swept. Defaults to an hour.
+        Returns:
+            dict: Result of each deletion, by MiCADO UUID
+        """
+        r = self.session.get(auth_url + '/instances.xml')
+        if r.status_code != 200:
+            raise MicadoException(
+                'Failed to list CloudBroker instances, request status code {0}, response: {1}'.format(r.status_code, r.text))
+        known = DataHandling.get_records(self.home + 'data.yml')
+        orphans = []
+        for instance in parse_instances(r.text):
+            if MICADO_NAME.match(instance.name) \
+                    and instance.status not in STOPPED_STATES \
+                    and (recorded or instance.id not in known) \
+                    and self._is_older(instance, min_age):
+                orphans.append(instance.id)
+        logger.info('Sweeping {} MiCADO VMs...'.format(len(orphans)))
+        records = DataHandling.remove_data(self.home + 'data.yml', orphans)
+        results = self._stop_instances(auth_url, orphans)
+        self._restore_failed(records, results)
+        return results
+
+    @staticmethod
+    def _is_older(instance, min_age):
+        try:
+            return seconds_since(instance.created) >= min_age
+        except ValueError:
+            logger.warning(
+                "Unknown creation time of {}, not swept.".format(instance.id))
+            return False
+
+    def _restore_failed(self, records, results):
+        """Record again the VMs whose deletion failed."""
+        failed = {
+            id: records[id] for id, result in results.items()
+            if result.startswith("Failed") and id in records
+        }
+        DataHandling.restore_data(self.home + 'data.yml', failed)
+
+    def _stop_instances(self, auth_url, ids):
+        """Stop instances in parallel over the pooled session."""
+        session = self.session
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+            return dict(zip(ids, pool.map(
+                self._stop_instance, repeat(session), repeat(auth_url), ids)))
+
+    def _stop_instance(self, session, auth_url, id):
+        try:
+            r = session.put(auth_url + '/instances/' + id + '/stop.xml')
+        except Exception as e:
+            logger.error(f"Exception cought: {e}")
+            return f"Failed: {e}"
+        if r.status_code != 200:
+            logger.error('Failed to stop {0}, request status code {1}, response: {2}'.format(id, r.status_code, r.text))
+            return f"Failed: {r.status_code}"
+        logger.info('Dropping node {}'.format(id))
+        if os.path.isfile(self.home + id + '-ssl.pem'):
+            logger.info("remove {}-ssl.pem".format(self.home + id))
+            os.remove(self.home + id + '-ssl.pem')
+        return "Destroyed"
+
+    def snapshot(self, id, name):
+        """
+        Snapshot an existing MiCADO VM into a reusable image.
+        Not supported through the CloudBroker API.
+        Raises:
+            MicadoException: Always.
+        """
+        raise MicadoException(
+            "Baked images are not supported by the CloudBroker launcher.")
+
     def _get_credentials(self):
         """
         Read CloudBroker credentials from file.
@@ -192,11 +524,20 @@ class CloudBrokerLauncher:
                 return resource.get("auth_data")
 
     def get_auth(self):
+        """
+        Return the CloudBroker (email, password), reading the credential
+        file again only when its modification time has changed.
+        """
+        mtime = os.stat(self.home + "credentials-cloud-api.yml").st_mtime_ns
+        if self._auth is not None and mtime == self._auth_mtime:
+            return self._auth
         auth_data = self._get_credentials()
         if (not auth_data) or (not "email" in auth_data) or (not "password" in auth_data):
             errormsg = "Cannot find credentials for CloudBroker. Please specify"
             logger.debug(errormsg)
-        return (auth_data['email'], auth_data['password'])
+        self._auth = (auth_data['email'], auth_data['password'])
+        self._auth_mtime = mtime
+        return self._auth
 
     def _persist_data(self, floating_ip_address, instanceID, auth_url, deployment_id, instance_type_id, key_pair_id, firewall_rule_set_id):
         """
@@ -213,33 +554,52 @@ class CloudBrokerLauncher:
                                   firewall_rule_set_id=firewall_rule_set_id,
                                   endpoint=endpoint)
 
-    def get_instance(self, auth_url, instanceid):
+    def wait_for_instance(self, auth_url, instanceid, timeout=LAUNCH_TIMEOUT, on_status=None):
+        """
+        Wait for an instance to be running, polling often at first and
+        backing off towards POLL_MAX seconds between polls. Concurrent
+        waits on the same endpoint share one InstanceTracker.
+        Args:
+            auth_url (string): CloudBroker API endpoint.
+            instanceid (string): ID of the instance.
+            timeout (int, optional): Overall deadline in seconds.
+            on_status (callable, optional): Called with the instance id,
+                the previous and the new status on every status change.
+        Raises:
+            MicadoException: The instance failed, or the deadline passed.
+        Returns:
+            InstanceInfo: The running instance
+        """
+        return self.tracker(auth_url).wait(instanceid, timeout, on_status)
+
+    def tracker(self, auth_url):
+        """Return the InstanceTracker of a CloudBroker endpoint."""
+        with self._trackers_lock:
+            if auth_url not in self._trackers:
+                self._trackers[auth_url] = InstanceTracker(self, auth_url)
+            return self._trackers[auth_url]
+
+    def get_instance(self, auth_url, instanceid, attempts=5):
         attempt = 0
         stime = 1
-        while attempt < 5:
+        while attempt < attempts:
             query_str = auth_url + '/instances/' + instanceid + '.xml'
-            r = requests.get(query_str, auth=self.get_auth())
+            r = self.session.get(query_str)
             if (r.status_code != 200):
                 logger.debug('CloudBroker API call failed! query: %s, status code %d, response: %s', query_str, r.status_code, r.text)
             else:
-                DOMTree = xml.dom.minidom.parseString(r.text)
-                instance = DOMTree.documentElement
-                if 0 != instance.getElementsByTagName('id').length:
+                instance = parse_instance(r.text)
+                if instance.id:
                     return instance
                 else:
                     logger.debug('CloudBroker API returned incorrect answer! No instance id is found.query: %s, status code %d, response: %s', query_str, r.status_code, r.text)
+            attempt += 1
+            if attempt == attempts:
+                break
             sleep(stime)
             stime = stime * 2
-            attempt += 1
             logger.debug('Retry calling the CloudBroker API...')
         errormsg = 'Error in querying instance \'{0}\' {1} times through CloudBroker API at \'{2}\'.'.format(
                str(instanceid), str(attempt), auth_url)
         logger.debug(errormsg)
         raise Exception(errormsg)
-
-    def getTagText(self, nodelist):
-        rc = []
-        for node in nodelist:
-            if node.nodeType == node.TEXT_NODE:
-                rc.append(node.data)
-        return ''.join(rc)
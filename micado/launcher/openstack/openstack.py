@@ -1,23 +1,28 @@
 #!/usr/bin/env python
 
+import base64
 import logging
 import logging.config
 import os
 import random
+import re
 import subprocess
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 import requests
+from keystoneauth1 import exceptions as ksa_exceptions
 from keystoneauth1 import session
 from micado.exceptions import MicadoException
-from micado.utils.utils import DataHandling, SSHKeyHandling
-from novaclient import client as nova_client
+from micado.utils.utils import DataHandling, SSHKeyHandling, seconds_since
 from ruamel.yaml import YAML
 
 import openstack
 from openstack import connection
+from openstack import exceptions as sdk_exceptions
 
 from .auth import AUTH_TYPES
 from micado.types.micado import MicadoInfo
@@ -27,6 +32,17 @@ from micado.types.micado import MicadoInfo
 """
 DEFAULT_PATH = Path.home() / ".micado-cli"
 DEFAULT_VERS = "0.9.1-rev1"
+MICADO_NAME = re.compile(r"^MiCADO-[0-9a-f]{32}$")
+DELETE_WORKERS = 8
+SWEEP_MIN_AGE = 3600  # seconds before an unrecorded MiCADO VM counts as orphaned
+# SDK errors raised before a create request is sent, which novaclient may avoid
+SDK_UNAVAILABLE = (
+    sdk_exceptions.EndpointNotFound,
+    sdk_exceptions.ServiceDiscoveryException,
+    sdk_exceptions.NotSupported,
+    ksa_exceptions.EndpointNotFound,
+    ksa_exceptions.EmptyCatalog,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -53,6 +69,7 @@ class OpenStackLauncher:
 
     """
     home = str(Path(os.environ.get("MICADO_CLI_DIR", DEFAULT_PATH))) + '/'
+    supports_snapshot = True  # whether snapshot() can bake images
 
     def launch(self, auth_url, image, flavor, network, keypair, security_group='all', region=None,
                user_domain_name='Default', project_id=None, **kwargs):
@@ -82,7 +99,7 @@ class OpenStackLauncher:
         """
         try:
             pub_key = SSHKeyHandling.get_pub_key(self.home)
-            conn, conn_nova = self._get_connection(
+            conn = self._get_connection(
                 auth_url, region, project_id, user_domain_name)
             image = conn.get_image(image)
             flavor = conn.get_flavor(flavor)
@@ -111,19 +128,16 @@ class OpenStackLauncher:
             - {}
             """.format(pub_key)
             name_id = uuid.uuid1()
-            server = conn_nova.servers.create(
-                'MiCADO-{}'.format(name_id.hex),
-                image.id,
-                flavor.id,
-                security_groups=[security_group.id],
-                nics=[{"net-id": network.id}],
-                key_name=keypair.name,
+            server = self._create_server(
+                conn,
+                region,
+                name='MiCADO-{}'.format(name_id.hex),
+                image=image,
+                flavor=flavor,
+                network=network,
+                keypair=keypair,
+                security_group=security_group,
                 userdata=cloud_init_config)
-            # server = conn.compute.create_server(
-            #     name='MiCADO-{}'.format(name_id.hex), image_id=image.id, flavor_id=flavor.id,
-            # key_name=keypair.name, userdata=cloud_init_config, timeout=300,
-            # networks=[{"uuid": network.id}], security_groups=[{"name":
-            # security_group.id}])
             logger.info('The VM {} starting...'.format(server.id))
             server = conn.get_server(server.id)
             logger.info('Waiting for running state, and attach {} floating ip...'.format(
@@ -157,25 +171,16 @@ class OpenStackLauncher:
             region_name = None
             project_id = None
             user_domain_name = None
-            yaml = YAML()
-            content = None
-            with open(self.home + 'data.yml', mode='r') as f:
-                content = yaml.load(f)
-            search = [i for i in content["micados"] if i.get(id, None)]
-            if not search:
+            server = DataHandling.remove_data(self.home + 'data.yml', [id]).get(id)
+            if server is None:
                 logger.debug(
                     "This {} ID can not find in the data file.".format(id))
-                pass
             else:
-                logger.debug("Remove {} record".format(search))
-                auth_url = search[0][id]["auth_url"]
-                region_name = search[0][id]["region_name"]
-                project_id = search[0][id]["project_id"]
-                user_domain_name = search[0][id]["user_domain_name"]
-                content["micados"].remove(search[0])
-                with open(self.home + 'data.yml', mode='w') as f:
-                    yaml.dump(content, f)
-            conn, _ = self._get_connection(
+                auth_url = server["auth_url"]
+                region_name = server["region_name"]
+                project_id = server["project_id"]
+                user_domain_name = server["user_domain_name"]
+            conn = self._get_connection(
                 auth_url, region_name, project_id, user_domain_name)
             if conn.get_server(id) is None:
                 raise MicadoException("{} is not a valid VM ID!".format(id))
@@ -188,6 +193,147 @@ class OpenStackLauncher:
         except MicadoException as e:
             logger.error(f"Exception cought: {e}")
 
+    def delete_many(self, ids):
+        """Destroy several existing MiCADO VMs concurrently.
+
+        VMs are grouped by the cloud they were launched on, so that each
+        cloud is authenticated once, and the data file is written once.
+        IDs missing from the data file are reported as not found, and the
+        VMs which could not be deleted stay recorded.
+
+        Args:
+            ids (list): The MiCADO UUIDs.
+
+        Returns:
+            dict: Result of each deletion, by MiCADO UUID
+        """
+        records = DataHandling.remove_data(self.home + 'data.yml', ids)
+        results = {}
+        clouds = {}
+        for id in ids:
+            server = records.get(id)
+            if server is None:
+                logger.error(
+                    "This {} ID can not find in the data file.".format(id))
+                results[id] = "Not found"
+                continue
+            cloud = (server["auth_url"], server["region_name"],
+                     server["project_id"], server["user_domain_name"])
+            clouds.setdefault(cloud, []).append(id)
+
+        for cloud, cloud_ids in clouds.items():
+            try:
+                conn = self._get_connection(*cloud)
+            except Exception as e:
+                logger.error(f"Exception cought: {e}")
+                results.update({id: f"Failed: {e}" for id in cloud_ids})
+                continue
+            results.update(self._delete_servers(conn, cloud_ids))
+        self._restore_failed(records, results)
+        return results
+
+    def sweep(self, auth_url, region=None, project_id=None,
+              user_domain_name='Default', recorded=False,
+              min_age=SWEEP_MIN_AGE):
+        """Destroy orphaned MiCADO VMs on a cloud.
+
+        Orphans are servers named after the MiCADO naming scheme
+        (MiCADO-<uuid>) which are not recorded in the data file. A VM is
+        only recorded once it is active, so servers younger than min_age
+        are left alone, as another client may still be launching them.
+
+        Args:
+            auth_url (string): Authentication URL for the NOVA resource.
+            region (string, optional): Name of the region resource.
+                Defaults to None.
+            project_id (string, optional): ID of the project resource.
+                Defaults to None.
+            user_domain_name (string, optional): Define the user_domain_name.
+                Defaults to 'Default'.
+            recorded (bool, optional): Also destroy the MiCADO VMs which
+                are recorded in the data file. Defaults to False.
+            min_age (int, optional): Seconds since a server was created
+                before it can be swept. Defaults to an hour.
+
+        Returns:
+            dict: Result of each deletion, by MiCADO UUID
+        """
+        conn = self._get_connection(
+            auth_url, region, project_id, user_domain_name)
+        known = DataHandling.get_records(self.home + 'data.yml')
+        orphans = [
+            server.id for server in conn.list_servers()
+            if MICADO_NAME.match(server.name)
+            and (recorded or server.id not in known)
+            and self._is_older(server, min_age)
+        ]
+        logger.info('Sweeping {} MiCADO VMs...'.format(len(orphans)))
+        records = DataHandling.remove_data(self.home + 'data.yml', orphans)
+        results = self._delete_servers(conn, orphans)
+        self._restore_failed(records, results)
+        return results
+
+    @staticmethod
+    def _is_older(server, min_age):
+        created = getattr(server, "created_at", None) or getattr(server, "created", None)
+        try:
+            return seconds_since(created) >= min_age
+        except ValueError:
+            logger.warning(
+                "Unknown creation time of {}, not swept.".format(server.id))
+            return False
+
+    def _restore_failed(self, records, results):
+        """Record again the VMs whose deletion failed."""
+        failed = {
+            id: records[id] for id, result in results.items()
+            if result.startswith("Failed") and id in records
+        }
+        DataHandling.restore_data(self.home + 'data.yml', failed)
+
+    def _delete_servers(self, conn, ids):
+        """Delete servers in parallel over a single connection."""
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as pool:
+            return dict(zip(ids, pool.map(self._delete_server, repeat(conn), ids)))
+
+    def _delete_server(self, conn, id):
+        try:
+            if not conn.delete_server(id):
+                logger.error("{} is not a valid VM ID!".format(id))
+                return "Not found"
+        except Exception as e:
+            logger.error(f"Exception cought: {e}")
+            return f"Failed: {e}"
+        logger.info('Dropping node {}'.format(id))
+        if os.path.isfile(self.home + id + '-ssl.pem'):
+            logger.info("remove {}-ssl.pem".format(self.home + id))
+            os.remove(self.home + id + '-ssl.pem')
+        return "Destroyed"
+
+    def snapshot(self, id, name):
+        """Snapshot an existing MiCADO VM into a reusable image.
+
+        Args:
+            id (string): The MiCADO UUID.
+            name (string): Name of the new image.
+
+        Raises:
+            MicadoException: Missing or incorrect data.
+
+        Returns:
+            string: ID of the new image
+        """
+        server = DataHandling.get_properties(self.home + 'data.yml', id)
+        conn = self._get_connection(
+            server["auth_url"], server["region_name"],
+            server["project_id"], server["user_domain_name"])
+        if conn.get_server(id) is None:
+            raise MicadoException("{} is not a valid VM ID!".format(id))
+        logger.info('Snapshotting node {} as {}...'.format(id, name))
+        image = conn.create_image_snapshot(name, id, wait=True, timeout=1800)
+        logger.info('Image {} created.'.format(image.id))
+        return image.id
+
     def _get_credentials(self):
         """Read credential from file.
 
@@ -234,6 +380,53 @@ class OpenStackLauncher:
         return [addr for addr in conn.list_floating_ips()
                 if addr.attached == False]
 
+    def _create_server(self, conn, region_name, name, image, flavor,
+                       network, keypair, security_group, userdata):
+        """Create the server through the OpenStackSDK compute proxy.
+
+        Falls back to novaclient (imported only here) only if the SDK
+        fails before sending the request, e.g. when it cannot find the
+        compute endpoint or does not support its microversion. Any later
+        error is raised, as the server may have been created already.
+
+        Args:
+            conn (Connection): OpenStackSDK connection
+            region_name (string): Name of the region resource
+            name (string): Name of the new server
+            image, flavor, network, keypair, security_group: OpenStackSDK
+                resources to boot the server with
+            userdata (string): cloud-init configuration
+
+        Returns:
+            Server: The created server (only its id is relied upon)
+        """
+        try:
+            return conn.compute.create_server(
+                name=name,
+                image_id=image.id,
+                flavor_id=flavor.id,
+                key_name=keypair.name,
+                user_data=base64.b64encode(
+                    userdata.encode("utf-8")).decode("utf-8"),
+                networks=[{"uuid": network.id}],
+                security_groups=[{"name": security_group.id}])
+        except SDK_UNAVAILABLE as e:
+            logger.warning(
+                f"OpenStackSDK could not create the VM ({e}), "
+                "retrying with novaclient...")
+
+        from novaclient import client as nova_client
+        conn_nova = nova_client.Client(
+            2, session=conn.session, region_name=region_name)
+        return conn_nova.servers.create(
+            name,
+            image.id,
+            flavor.id,
+            security_groups=[security_group.id],
+            nics=[{"net-id": network.id}],
+            key_name=keypair.name,
+            userdata=userdata)
+
     def _get_connection(
         self, auth_url, region_name, project_id, user_domain_name
     ):
@@ -253,7 +446,7 @@ class OpenStackLauncher:
             Exception: Project ID missing
 
         Returns:
-            tuple: OpenStackSDK connection, and nova_client Connection
+            Connection: OpenStackSDK connection
         """
         logger.info("Pulling credentials...")
         authenticator = self._get_credentials()
@@ -264,14 +457,11 @@ class OpenStackLauncher:
         logger.info("Authenticating with OpenStack...")
         auth = authenticator.authenticate()
         sess = session.Session(auth=auth)
-        return (
-            connection.Connection(
-                region_name=region_name,
-                session=sess,
-                compute_api_version="2",
-                identity_interface="public",
-            ),
-            nova_client.Client(2, session=sess, region_name=region_name),
+        return connection.Connection(
+            region_name=region_name,
+            session=sess,
+            compute_api_version="2",
+            identity_interface="public",
         )
 
     def _persist_data(self, ip, server_id, auth_url,
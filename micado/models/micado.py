@@ -1,15 +1,26 @@
 """
 Higher-level methods to manage the MiCADO node
 """
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from micado.models.pool import CLAIM_TAGS, MAX_IDLE, POOL_SIZE, WarmPool
+from micado.types.micado import PHASES, MicadoInfo
+from micado.exceptions import MicadoException
 from micado.utils.utils import DataHandling
 
 from ..api.client import SubmitterClient
 from .base import Model
 
 DEFAULT_PATH = Path.home() / ".micado-cli"
+GRACEFUL_TIMEOUT = 300  # seconds allowed to delete applications before the VM
+FAST_TIMEOUT = 5  # seconds allowed to list the applications left by a fast destroy
+IMAGE_SCOPE = ("auth_url", "region", "project_id")  # where a baked image exists
+
+logger = logging.getLogger(__name__)
 
 
 class Micado(Model):
@@ -42,6 +53,18 @@ class Micado(Model):
     def details(self, details):        
         self.client.details = details
 
+    @property
+    def timings(self):
+        return getattr(self.client, "timings", {})
+
+    @timings.setter
+    def timings(self, timings):
+        self.client.timings = timings
+
+    @property
+    def pool(self):
+        return getattr(self.client, "warm_pool", None)
+
     @property
     def launcher(self):
         return self.client.launcher
@@ -90,7 +113,7 @@ class Micado(Model):
         self.micado_id = micado_id
         self.api = self.init_api()
 
-    def create(self, **kwargs):
+    def create(self, baked=False, resume=None, keep_on_failure=False, **kwargs):
         """Creates a new MiCADO VM and deploy MiCADO services on it.
 
         Args:
@@ -112,6 +135,32 @@ class Micado(Model):
                 Defaults to admin.
             micado_password (string, optional): MiCADO password.
                 Defaults to admin.
+            baked (bool, optional): Boot from the image recorded by bake()
+                for this MiCADO version, cloud, region and project, and only
+                finalise the install.
+                Defaults to False.
+            accelerate (bool, optional): Run the playbook with the Ansible
+                performance profile (pipelining, persistent connections,
+                fact caching, free strategy). With the free strategy, tasks
+                are no longer run in step across hosts. Defaults to False.
+            full (bool, optional): Run the whole playbook, even for inputs
+                unchanged since the last successful run. Defaults to False.
+            on_progress (callable, optional): Called with a TaskProgress as
+                each playbook task starts and completes. Defaults to None.
+            resume (string, optional): ID of a MiCADO whose creation failed,
+                to continue from its last completed phase (see PHASES),
+                with the credentials it was created with. Defaults to None.
+            keep_on_failure (bool, optional): Keep the VM when a phase after
+                its launch fails, so that creation can be resumed. Otherwise
+                delete it. Defaults to False.
+
+        With use_pool(), an idle node is claimed from the warm pool when
+        one matches the launch arguments. The requested MiCADO credentials,
+        or newly generated ones, then replace those it was warmed with.
+
+        The installer prepares the install (e.g. fetches the playbook)
+        while the VM boots. The start and end of each phase, in seconds,
+        are kept in the timings attribute.
 
         Usage:
 
@@ -129,28 +178,263 @@ class Micado(Model):
             string: ID of MiCADO
 
         """
-        try:
-            _micado = self.launcher.launch(**kwargs)
-            self.micado_id = _micado.id
-            self.micado_ip = _micado.ip
+        self._start_timings()
+        if resume:
+            return self._resume(resume, baked, keep_on_failure, **kwargs)
+        if self.pool:
+            _micado = self._timed("claim", self.pool.claim, **kwargs)
+            self.pool.replenish(**kwargs)
+            if _micado:
+                return self._claim(_micado, keep_on_failure, **kwargs)
+        if baked:
+            kwargs["image"] = DataHandling.get_image(
+                f"{self.home}data.yml",
+                self.installer.micado_version,
+                **{key: kwargs.get(key) for key in IMAGE_SCOPE},
+            )
+
+        # Prepare the install while the VM boots, as it does not need the VM
+        prepared = None
+        prepare = getattr(self.installer, "prepare", None)
+        if prepare:
+            pool = ThreadPoolExecutor(max_workers=1)
+            prepared = pool.submit(self._timed, "prepare", prepare, **kwargs)
+            pool.shutdown(wait=False)
+        _micado = self._timed("launch", self.launcher.launch, **kwargs)
+        self.micado_id = _micado.id
+        self.micado_ip = _micado.ip
+        if prepared:
+            try:
+                prepared.result()
+            except Exception as e:
+                logger.warning(f"Preparing the install failed, retrying later: {e}")
+        return self._install(_micado, None, baked, keep_on_failure, **kwargs)
+
+    def _resume(self, micado_id, baked, keep_on_failure, **kwargs):
+        """Continue create() on an existing VM, after its last checkpoint"""
+        server = DataHandling.get_properties(f"{self.home}data.yml", micado_id)
+        self.micado_id = micado_id
+        self.micado_ip = server["ip"]
+        phase = server.get("phase")
+        logger.info(f"Resuming {micado_id} after phase: {phase}")
+        for key in ("micado_user", "micado_password"):
+            if server.get(key):
+                kwargs.setdefault(key, server[key])
+
+        _micado = MicadoInfo(micado_id, server["ip"])
+        return self._install(_micado, phase, baked, keep_on_failure, **kwargs)
 
-            self.installer.deploy(_micado, **kwargs)
+    def _claim(self, _micado, keep_on_failure, **kwargs):
+        """Finish create() with a node claimed from the pool, replacing the
+        credentials generated when it was warmed with the requested ones,
+        or with newly generated ones, so no two claims share a secret"""
+        self.micado_id = _micado.id
+        self.micado_ip = _micado.ip
+        return self._install(
+            _micado, "ports_open", False, keep_on_failure, tags=CLAIM_TAGS, **kwargs
+        )
+
+    def use_pool(self, size=POOL_SIZE, max_idle=MAX_IDLE, evict_stale=True):
+        """Make create() claim installed, idle MiCADO nodes from a warm pool,
+        and replenish the pool in the background.
+
+        Nodes are pooled by launch arguments. When the pool is empty,
+        create() launches and installs a node as usual. A script exiting
+        while the pool is replenished waits for the refill to finish.
+
+        Args:
+            size (int, optional): Idle nodes to keep per set of launch
+                arguments. Defaults to 1.
+            max_idle (int, optional): Seconds before an idle node is deleted.
+                Defaults to a day.
+            evict_stale (bool, optional): Delete idle nodes installed with
+                another MiCADO version. Defaults to True.
+
+        Usage:
+
+            >>> client.micado.use_pool(size=2)
+            >>> client.micado.pool.fill(auth_url='yourendpoint', ...)
+            >>> client.micado.create(auth_url='yourendpoint', ...)
+
+        Returns:
+            WarmPool: The pool
+        """
+        self.client.warm_pool = WarmPool(
+            self.launcher,
+            self.installer,
+            self.home,
+            size=size,
+            max_idle=max_idle,
+            evict_stale=evict_stale,
+        )
+        return self.client.warm_pool
+
+    def _install(self, _micado, phase, baked, keep_on_failure, **kwargs):
+        """Run the phases of create() which follow phase"""
+        try:
+            if phase is None:
+                self._checkpoint("launched")
+            if phase != PHASES[-1]:
+                self.installer.deploy(
+                    _micado,
+                    baked=baked,
+                    phase=phase,
+                    checkpoint=self._checkpoint,
+                    **kwargs,
+                )
             self.api = self.init_api()
-        except Exception as e:
-            if hasattr(locals()["self"], "micado_id"):
+            self.api.applications()  # a real request, before checkpointing
+            self._checkpoint("api_verified")
+            self._log_timings()
+        except Exception:
+            if not keep_on_failure:
+                logger.error(
+                    f"Creating {self.micado_id} failed, deleting it. Pass "
+                    "keep_on_failure=True to keep it and resume the creation."
+                )
                 self.launcher.delete(self.micado_id)
+                raise
+            logger.error(
+                f"Creating {self.micado_id} failed. Resume it with create(resume="
+                f"'{self.micado_id}'), or delete it with launcher.delete()."
+            )
             raise
         return self.micado_id
 
-    def destroy(self):
+    def _checkpoint(self, phase):
+        """Record the last phase of create() completed on this MiCADO"""
+        DataHandling.update_data(f"{self.home}data.yml", self.micado_id, phase=phase)
+        now = time.monotonic() - self._started
+        if phase != "launched":
+            self.timings[phase] = (self._last_checkpoint, now)
+        self._last_checkpoint = now
+
+    def _start_timings(self):
+        """Reset timings, where each phase maps to its start and end, in
+        seconds since create() was called"""
+        self.timings = {}
+        self._started = time.monotonic()
+        self._last_checkpoint = 0.0
+
+    def _timed(self, name, func, *args, **kwargs):
+        start = time.monotonic() - self._started
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timings[name] = (start, time.monotonic() - self._started)
+
+    def _log_timings(self):
+        logger.info(
+            "Phase timings: "
+            + ", ".join(
+                f"{name} {start:.1f}-{end:.1f}s"
+                for name, (start, end) in sorted(
+                    self.timings.items(), key=lambda i: i[1]
+                )
+            )
+        )
+
+    def bake(self, **kwargs):
+        """Builds MiCADO on a new VM and snapshots it as a reusable image.
+
+        Accepts the same arguments as create(). The image is recorded
+        for the installer's MiCADO version, cloud, region and project,
+        then the VM is deleted.
+
+        Raises:
+            MicadoException: When the launcher cannot snapshot VMs, before
+                any VM is launched
+
+        Usage:
+
+            >>> client.micado.bake(
+            ...     auth_url='yourendpoint',
+            ...     image='ubuntu_image_name or image_id',
+            ...     ...
+            ... )
+            >>> client.micado.create(baked=True, auth_url='yourendpoint', ...)
+
+        Returns:
+            string: ID of the image
+        """
+        snapshots = hasattr(self.launcher, "snapshot")
+        if not getattr(self.launcher, "supports_snapshot", snapshots):
+            raise MicadoException(
+                f"{type(self.launcher).__name__} cannot snapshot VMs, "
+                "so it cannot bake images."
+            )
+        version = self.installer.micado_version
+        _micado = self.launcher.launch(**kwargs)
+        try:
+            self.installer.build(_micado, **kwargs)
+            image_id = self.launcher.snapshot(_micado.id, f"MiCADO-{version}")
+        finally:
+            self.launcher.delete(_micado.id)
+
+        DataHandling.persist_image(
+            f"{self.home}data.yml",
+            version,
+            image_id,
+            **{key: kwargs.get(key) for key in IMAGE_SCOPE},
+        )
+        return image_id
+
+    def destroy(self, mode="graceful", timeout=GRACEFUL_TIMEOUT, leave_resources=False):
         """Destroy running applications and the existing MiCADO VM.
 
+        Args:
+            mode (string, optional): "graceful" deletes the applications
+                concurrently, for up to timeout seconds, then the VM.
+                "fast" deletes the VM straight away, and needs
+                leave_resources. Defaults to "graceful".
+            timeout (float, optional): Seconds allowed for the graceful
+                deletion of applications. Defaults to GRACEFUL_TIMEOUT.
+            leave_resources (bool, optional): Confirm that the cloud
+                resources of running applications may be left behind, as
+                a fast destroy does. Defaults to False.
+
+        The cloud resources created by applications (e.g. worker nodes)
+        are only removed by a graceful deletion. In fast mode, and for
+        the applications a graceful deletion did not finish, their
+        resources are left to be removed from the cloud.
+
+        Raises:
+            MicadoException: For a fast destroy without leave_resources,
+                before anything is deleted
+
         Usage:
 
             >>> client.micado.destroy()
+            >>> client.micado.destroy(mode="fast", leave_resources=True)
 
         """
-        self.api = self.init_api()
-        self.api._destroy()
+        if mode not in ("graceful", "fast"):
+            raise MicadoException(f"Unknown destroy mode: {mode}")
+        if mode == "fast" and not leave_resources:
+            raise MicadoException(
+                "A fast destroy leaves the cloud resources of running "
+                "applications behind. Pass leave_resources=True to confirm, "
+                "or use the graceful mode."
+            )
+        if mode == "graceful":
+            self.api = self.init_api()
+            remaining = self.api._destroy(timeout=timeout)
+        else:
+            remaining = self._list_apps()
+        if remaining:
+            logger.warning(
+                "Cloud resources of these applications may remain: "
+                + ", ".join(remaining)
+            )
         self.api = None
         self.launcher.delete(self.micado_id)
+
+    def _list_apps(self):
+        """Best effort listing of the running applications, within
+        FAST_TIMEOUT seconds"""
+        try:
+            api = self.init_api()
+            url = api._url("/applications/")
+            return api.get(url, timeout=FAST_TIMEOUT).json()["applications"]
+        except Exception:
+            return []
@@ -0,0 +1,226 @@
+"""
+Warm pool of installed, idle MiCADO nodes, ready to be claimed
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from micado.types.micado import MicadoInfo
+from micado.utils.files import file_lock
+from micado.utils.utils import DataHandling
+
+POOL_SIZE = 1  # idle nodes to keep per spec
+# configure and start components, which applies the MiCADO credentials of
+# a claimed node (update-auth only re-applies cloud and registry credentials)
+CLAIM_TAGS = "start"
+MAX_IDLE = 24 * 3600  # seconds before an idle node is evicted
+WARM_TIMEOUT = 3600  # seconds allowed to launch and install a pool node
+# create() arguments which do not change the VM, so do not split the pool
+INSTALL_OPTIONS = (
+    "micado_user",
+    "micado_password",
+    "baked",
+    "resume",
+    "keep_on_failure",
+    "full",
+    "accelerate",
+    "on_progress",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WarmPool:
+    """Keeps installed, idle MiCADO nodes for each spec, to be claimed
+    by Micado.create() instead of launching and installing a new one
+
+    A spec is the set of launch arguments. Pool nodes are recorded in the
+    data file, with the spec, the MiCADO version and the time they became
+    ready, so pools are shared by every client using the same data file.
+
+    Args:
+        launcher: Launcher creating the nodes
+        installer: Installer deploying MiCADO on the nodes
+        home (string): Directory of the data file
+        size (int, optional): Idle nodes to keep per spec.
+            Defaults to POOL_SIZE.
+        max_idle (int, optional): Seconds an idle node is kept.
+            Defaults to MAX_IDLE.
+        evict_stale (bool, optional): Evict nodes installed with another
+            MiCADO version than the installer's. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        launcher,
+        installer,
+        home,
+        size=POOL_SIZE,
+        max_idle=MAX_IDLE,
+        evict_stale=True,
+    ):
+        self.launcher = launcher
+        self.installer = installer
+        self.data_file = f"{home}data.yml"
+        self.lock_file = f"{home}pool.lock"
+        self.size = size
+        self.max_idle = max_idle
+        self.evict_stale = evict_stale
+        self._lock = threading.Lock()
+        self._warming = {}  # nodes being installed by this process, by spec
+        self._fillers = {}  # background fill threads, by spec
+
+    @staticmethod
+    def spec(**kwargs) -> str:
+        """Return the pool key of a set of create() arguments"""
+        launch = {k: v for k, v in kwargs.items() if k not in INSTALL_OPTIONS}
+        dump = json.dumps(launch, sort_keys=True, default=str)
+        return hashlib.sha256(dump.encode()).hexdigest()
+
+    def idle(self, spec=None) -> dict:
+        """Return the records of the ready, idle nodes, oldest first
+
+        Args:
+            spec (string, optional): Only the nodes of this spec
+        """
+        records = DataHandling.get_records(self.data_file)
+        nodes = {
+            id: record
+            for id, record in records.items()
+            if record.get("pool_state") == "ready"
+            and (spec is None or record.get("pool") == spec)
+        }
+        return dict(sorted(nodes.items(), key=lambda i: i[1].get("pooled_at", 0)))
+
+    def claim(self, **kwargs):
+        """Take an idle node of the spec out of the pool
+
+        Returns:
+            MicadoInfo: The claimed node, or None if the pool is empty
+        """
+        self.evict()
+        spec = self.spec(**kwargs)
+        with file_lock(self.lock_file):
+            nodes = self.idle(spec)
+            if not nodes:
+                logger.info("No idle MiCADO in the pool.")
+                return None
+            id, record = next(iter(nodes.items()))
+            DataHandling.update_data(
+                self.data_file,
+                id,
+                pool=None,
+                pool_state="claimed",
+                claimed_at=time.time(),
+            )
+        logger.info(f"Claimed {id} from the pool.")
+        return MicadoInfo(id, record["ip"])
+
+    def evict(self):
+        """Delete the idle nodes past max_idle or, with evict_stale, of
+        another MiCADO version, and the nodes left warming for longer than
+        WARM_TIMEOUT and max_idle, e.g. by a process which was killed
+
+        Returns:
+            dict: Result of each deletion, by MiCADO ID
+        """
+        now = time.time()
+        version = self.installer.micado_version
+        with file_lock(self.lock_file):
+            evicted = [
+                id
+                for id, record in self.idle().items()
+                if now - record.get("pooled_at", 0) > self.max_idle
+                or (self.evict_stale and record.get("version") != version)
+            ]
+            evicted += [
+                id
+                for id, record in DataHandling.get_records(self.data_file).items()
+                if record.get("pool_state") == "warming"
+                and now - record.get("warming_at", 0) > WARM_TIMEOUT + self.max_idle
+            ]
+            if evicted:
+                with DataHandling.batch(self.data_file) as store:
+                    for id in evicted:
+                        store.update_data(id, pool_state="evicted")
+        if not evicted:
+            return {}
+        logger.info(f"Evicting {len(evicted)} MiCADO nodes from the pool...")
+        return self.launcher.delete_many(evicted)
+
+    def replenish(self, **kwargs):
+        """Fill the pool of the spec in the background, unless this process
+        is already filling it
+
+        The thread is not a daemon, so an exiting interpreter waits for the
+        node being installed rather than leaving it half-installed.
+
+        Returns:
+            threading.Thread: The fill thread
+        """
+        spec = self.spec(**kwargs)
+        with self._lock:
+            filler = self._fillers.get(spec)
+            if filler and filler.is_alive():
+                return filler
+            filler = threading.Thread(
+                target=self._fill_quietly,
+                kwargs=kwargs,
+                name=f"pool-{spec[:8]}",
+            )
+            self._fillers[spec] = filler
+        filler.start()
+        return filler
+
+    def fill(self, **kwargs):
+        """Launch and install nodes until the pool of the spec is full
+
+        Accepts the launch arguments of create(). The nodes get generated
+        MiCADO credentials.
+
+        Returns:
+            list: IDs of the nodes added to the pool
+        """
+        spec = self.spec(**kwargs)
+        kwargs = {k: v for k, v in kwargs.items() if k not in INSTALL_OPTIONS}
+        added = []
+        while True:
+            with self._lock:
+                if len(self.idle(spec)) + self._warming.get(spec, 0) >= self.size:
+                    return added
+                self._warming[spec] = self._warming.get(spec, 0) + 1
+            try:
+                added.append(self._warm(spec, **kwargs))
+            finally:
+                with self._lock:
+                    self._warming[spec] -= 1
+
+    def _fill_quietly(self, **kwargs):
+        try:
+            self.fill(**kwargs)
+        except Exception as e:
+            logger.error(f"Replenishing the MiCADO pool failed: {e}")
+
+    def _warm(self, spec, **kwargs):
+        """Launch and install one node, then add it to the pool"""
+        micado = self.launcher.launch(**kwargs)
+        DataHandling.update_data(
+            self.data_file,
+            micado.id,
+            pool=spec,
+            pool_state="warming",
+            warming_at=time.time(),
+            version=self.installer.micado_version,
+        )
+        try:
+            self.installer.deploy(micado, **kwargs)
+        except Exception:
+            self.launcher.delete(micado.id)
+            raise
+        DataHandling.update_data(
+            self.data_file, micado.id, pool_state="ready", pooled_at=time.time()
+        )
+        logger.info(f"Added {micado.id} to the pool.")
+        return micado.id
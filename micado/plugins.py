@@ -0,0 +1,101 @@
+"""
+
+Lazy registries for the launcher and installer plugins
+
+"""
+
+import sys
+from collections.abc import Mapping
+from importlib import import_module
+
+
+class PluginRegistry(Mapping):
+    """Maps plugin names to classes, importing a module only when selected
+
+    Built-in plugins are given as "module:attribute" strings. Third-party
+    plugins are discovered from the entry point group, for example:
+
+        entry_points={
+            "micado.launchers": ["mycloud=mypackage.launcher:MyLauncher"],
+        }
+
+    Args:
+        group (string): Entry point group to search for extra plugins
+        builtins (dict): Plugin names mapped to "module:attribute" strings
+    """
+
+    def __init__(self, group, builtins):
+        self.group = group
+        self._targets = dict(builtins)
+        self._loaded = {}
+        self._discovered = False
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name not in self._targets:
+                self._discover()
+            self._loaded[name] = _resolve(self._targets[name])
+        return self._loaded[name]
+
+    def __iter__(self):
+        self._discover()
+        return iter(self._targets)
+
+    def __len__(self):
+        self._discover()
+        return len(self._targets)
+
+    def register(self, name, target):
+        """Add or override a plugin
+
+        Args:
+            name (string): Name used to select the plugin
+            target (string or class): "module:attribute" string or the
+                plugin class itself
+        """
+        self._targets[name] = target
+        self._loaded.pop(name, None)
+        if not isinstance(target, str):
+            self._loaded[name] = target
+
+    def _discover(self):
+        """Add entry point plugins, without overriding the built-ins"""
+        if self._discovered:
+            return
+        self._discovered = True
+        for entry_point in _entry_points(self.group):
+            self._targets.setdefault(entry_point.name, entry_point.value)
+
+
+def _entry_points(group):
+    from importlib.metadata import entry_points
+
+    if sys.version_info >= (3, 10):
+        return entry_points(group=group)
+    return entry_points().get(group, [])
+
+
+def _resolve(target):
+    if not isinstance(target, str):
+        return target
+    module, _, attribute = target.partition(":")
+    obj = import_module(module)
+    for part in attribute.split("."):
+        obj = getattr(obj, part) if part else obj
+    return obj
+
+
+LAUNCHERS = PluginRegistry(
+    "micado.launchers",
+    {
+        "openstack": "micado.launcher.openstack:OpenStackLauncher",
+        "cloudbroker": "micado.launcher.cloudbroker:CloudBrokerLauncher",
+    },
+)
+
+INSTALLER = PluginRegistry(
+    "micado.installers",
+    {
+        "ansible": "micado.installer.ansible:AnsibleInstaller",
+    },
+)
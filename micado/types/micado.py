@@ -1,7 +1,16 @@
 from dataclasses import dataclass
 
+# Checkpoints of Micado.create(), in order, recorded as "phase" in the data file
+PHASES = ("launched", "ports_open", "playbook_done", "cert_fetched", "api_verified")
+
 @dataclass
 class MicadoInfo:
     """For storing MiCADO node information."""
     id: str
-    ip: str
\ No newline at end of file
+    ip: str
+
+def completed_phases(phase):
+    """Return the phases completed up to and including phase"""
+    if phase not in PHASES:
+        return ()
+    return PHASES[: PHASES.index(phase) + 1]
@@ -0,0 +1,49 @@
+"""
+
+Locked and atomic file updates
+
+"""
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a lock file while in the block.
+
+    Args:
+        path (string): Lock file location, created if missing
+    """
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(path, mode="w", perms=None):
+    """Write a file through a temporary file renamed into place on success.
+
+    Args:
+        path (string): Final file location
+        mode (string, optional): "w" or "wb". Defaults to "w".
+        perms (int, optional): Permissions of the final file.
+            Defaults to those of the temporary file (0o600).
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if perms is not None:
+            os.chmod(tmp_path, perms)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,372 @@
+"""
+
+Backends of the node store behind utils.DataHandling
+
+"""
+import json
+import logging
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+from micado.utils.files import atomic_write, file_lock
+
+STORE = os.environ.get("MICADO_STORE", "yaml")  # backend of the node store
+SQLITE_TIMEOUT = 30  # seconds to wait for another writer to commit
+_SCHEMA_CHECK = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'micados'"
+
+logger = logging.getLogger(__name__)
+
+
+class YAMLStore:
+    """Node store kept in a YAML file, as lists of single-key mappings
+
+    Changes are made under an exclusive lock on a sibling lock file, and
+    written to a temporary file renamed over the data file, so concurrent
+    writers do not lose records and readers never see a partial file.
+
+    Args:
+        path (string): Location of the YAML file, e.g. data.yml
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._batch = None
+
+    def _load(self):
+        if self._batch is not None:
+            return self._batch
+        yaml = YAML()
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path) as f:
+            return yaml.load(f)
+
+    @contextmanager
+    def _edit(self):
+        """Yield the content to change, written back if no error is raised"""
+        if self._batch is not None:
+            yield self._batch
+            return
+        with file_lock(self.lock_path):
+            content = self._load()
+            if content is None:
+                logger.debug("Data file does not exist or is empty...")
+                content = dict()
+            elif not isinstance(content, dict):
+                raise ValueError(f"{self.path} is not a MiCADO data file")
+            yield content
+            yaml = YAML()
+            yaml.indent(mapping=2, sequence=4, offset=2)
+            with atomic_write(self.path) as f:
+                yaml.dump(content, f)
+
+    @contextmanager
+    def batch(self):
+        """Hold the lock and write the file once for several changes"""
+        with self._edit() as content:
+            self._batch = content
+            try:
+                yield self
+            finally:
+                self._batch = None
+
+    def persist_data(self, server_id, **kwargs):
+        with self._edit() as content:
+            if not content.get("micados"):
+                content["micados"] = list()
+            content["micados"].append({server_id: dict(kwargs)})
+
+    def get_properties(self, server_id):
+        content = self._load()
+        if content is None:
+            raise FileNotFoundError(self.path)
+        search = [i for i in content.get("micados") or [] if i.get(server_id, None)]
+        if not search:
+            logger.error("Can't find {} record!".format(server_id))
+            raise LookupError("Can't find property!")
+        return search[0][server_id]
+
+    def update_data(self, server_id, **kwargs):
+        with self._edit() as content:
+            for i in content.get("micados") or []:
+                if i.get(server_id, None) != None:
+                    i[server_id].update(kwargs)
+                    logger.debug("Data updated...")
+                    break
+            else:
+                logger.error("Can't find {} record!".format(server_id))
+                raise LookupError("Can't find property!")
+
+    def get_records(self):
+        records = dict()
+        for i in (self._load() or {}).get("micados") or []:
+            records.update(i)
+        return records
+
+    def remove_data(self, server_ids):
+        server_ids = set(server_ids)
+        if not server_ids.intersection(self.get_records()):
+            return dict()
+        removed = dict()
+        with self._edit() as content:
+            kept = list()
+            for i in content.get("micados") or []:
+                matches = server_ids.intersection(i)
+                if matches:
+                    removed.update({key: i[key] for key in matches})
+                else:
+                    kept.append(i)
+            logger.debug("Remove {} records".format(list(removed)))
+            content["micados"] = kept
+        return removed
+
+    def persist_image(self, version, **kwargs):
+        with self._edit() as content:
+            if not content.get("images"):
+                content["images"] = list()
+            content["images"].append({version: dict(kwargs)})
+
+    def get_images(self, version):
+        images = (self._load() or {}).get("images") or []
+        return [image[version] for image in images if image.get(version)]
+
+
+class SQLiteStore:
+    """Node store kept in an SQLite database, indexed by MiCADO ID
+
+    Properties are stored as JSON. Every change is a transaction, so
+    concurrent processes do not lose each other's updates. When the
+    database is first created, the records of the YAML file it replaces
+    are imported into it.
+
+    Args:
+        path (string): Location of the YAML file the store replaces, e.g.
+            data.yml. The database is kept next to it, as data.db
+    """
+
+    def __init__(self, path):
+        self.yaml_path = Path(path)
+        self.path = self.yaml_path.with_suffix(".db")
+        self._batch = None
+        self.imported = None  # records imported when this opened a new database
+        if not self._has_schema():
+            self._create()
+
+    @contextmanager
+    def batch(self):
+        """Make several changes in a single transaction"""
+        with self._transaction() as conn:
+            self._batch = conn
+            try:
+                yield self
+            finally:
+                self._batch = None
+
+    @contextmanager
+    def _transaction(self):
+        """Yield a connection in a write transaction, committed on success"""
+        if self._batch is not None:
+            yield self._batch
+            return
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        with closing(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _query(self, sql, *params):
+        if self._batch is not None:
+            return self._batch.execute(sql, params).fetchall()
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+        with closing(conn):
+            return conn.execute(sql, params).fetchall()
+
+    def _has_schema(self):
+        if not self.path.exists():
+            return False
+        return bool(self._query(_SCHEMA_CHECK))
+
+    def _create(self):
+        """Create the tables, and import the YAML file, in one transaction
+
+        The tables are created if missing, so processes opening the same
+        new database at once wait for each other instead of failing, and
+        only the one which created them imports the YAML file.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as conn:
+            if conn.execute(_SCHEMA_CHECK).fetchall():
+                return  # created by another process meanwhile
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS micados"
+                " (id TEXT PRIMARY KEY, properties TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " version TEXT NOT NULL, properties TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS images_version ON images (version)"
+            )
+            if self.yaml_path.is_file():
+                self.imported = self._import(conn, self.yaml_path)
+
+    def import_yaml(self, yaml_path=None):
+        """Copy the records of a YAML data file into the database
+
+        Records already in the database are overwritten by those of the
+        file, and images already in the database are not added again, so
+        importing the same file twice changes nothing.
+
+        Args:
+            yaml_path (string, optional): Location of the YAML data file.
+                Defaults to the file the store replaces.
+
+        Returns:
+            int: Number of MiCADO records imported
+        """
+        with self._transaction() as conn:
+            return self._import(conn, yaml_path or self.yaml_path)
+
+    def _import(self, conn, yaml_path):
+        micados, images = _read_yaml(yaml_path)
+        conn.executemany(
+            "INSERT OR REPLACE INTO micados (id, properties) VALUES (?, ?)",
+            [(id, _dumps(properties)) for id, properties in micados.items()],
+        )
+        for version, properties in images:
+            properties = _dumps(properties)
+            conn.execute(
+                "INSERT INTO images (version, properties) SELECT ?, ?"
+                " WHERE NOT EXISTS"
+                " (SELECT 1 FROM images WHERE version = ? AND properties = ?)",
+                (version, properties, version, properties),
+            )
+        logger.info(f"Imported {len(micados)} MiCADO records from {yaml_path}")
+        return len(micados)
+
+    def persist_data(self, server_id, **kwargs):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO micados (id, properties) VALUES (?, ?)",
+                (server_id, _dumps(kwargs)),
+            )
+
+    def get_properties(self, server_id):
+        rows = self._query("SELECT properties FROM micados WHERE id = ?", server_id)
+        if not rows:
+            logger.error("Can't find {} record!".format(server_id))
+            raise LookupError("Can't find property!")
+        return json.loads(rows[0][0])
+
+    def update_data(self, server_id, **kwargs):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT properties FROM micados WHERE id = ?", (server_id,)
+            ).fetchall()
+            if not rows:
+                logger.error("Can't find {} record!".format(server_id))
+                raise LookupError("Can't find property!")
+            properties = json.loads(rows[0][0])
+            properties.update(kwargs)
+            conn.execute(
+                "UPDATE micados SET properties = ? WHERE id = ?",
+                (_dumps(properties), server_id),
+            )
+
+    def get_records(self):
+        rows = self._query("SELECT id, properties FROM micados ORDER BY rowid")
+        return {id: json.loads(properties) for id, properties in rows}
+
+    def remove_data(self, server_ids):
+        server_ids = list(server_ids)
+        if not server_ids:
+            return {}
+        marks = ", ".join("?" * len(server_ids))
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id, properties FROM micados WHERE id IN ({marks})", server_ids
+            ).fetchall()
+            conn.execute(f"DELETE FROM micados WHERE id IN ({marks})", server_ids)
+        if rows:
+            logger.debug("Remove {} records".format([id for id, _ in rows]))
+        return {id: json.loads(properties) for id, properties in rows}
+
+    def persist_image(self, version, **kwargs):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO images (version, properties) VALUES (?, ?)",
+                (version, _dumps(kwargs)),
+            )
+
+    def get_images(self, version):
+        rows = self._query(
+            "SELECT properties FROM images WHERE version = ? ORDER BY seq", version
+        )
+        return [json.loads(properties) for properties, in rows]
+
+
+STORES = {"yaml": YAMLStore, "sqlite": SQLiteStore}
+
+
+def get_store(path, backend=None):
+    """Return the node store of a data file
+
+    Args:
+        path (string): Location of the data file, e.g. data.yml
+        backend (string, optional): Key of STORES. Defaults to the
+            MICADO_STORE environment variable, or "yaml"
+    """
+    backend = backend or STORE
+    try:
+        return STORES[backend](path)
+    except KeyError:
+        raise ValueError(f"Unknown node store: {backend}")
+
+
+def import_yaml(yaml_path):
+    """Copy the records of a YAML data file into the SQLite store next to it
+
+    A database created by this call has imported the file already, so it
+    is not imported twice.
+
+    Args:
+        yaml_path (string): Location of the YAML data file
+
+    Returns:
+        int: Number of MiCADO records imported
+    """
+    store = SQLiteStore(yaml_path)
+    if store.imported is not None:
+        return store.imported
+    return store.import_yaml()
+
+
+def _read_yaml(yaml_path):
+    """Return the MiCADO records by ID, and the (version, image) pairs,
+    of a YAML data file"""
+    source = YAMLStore(yaml_path)
+    micados = {
+        id: dict(properties or {}) for id, properties in source.get_records().items()
+    }
+    images = [
+        (version, dict(properties))
+        for image in (source._load() or {}).get("images") or []
+        for version, properties in image.items()
+    ]
+    return micados, images
+
+
+def _dumps(properties):
+    return json.dumps(dict(properties), sort_keys=True, default=str)
+
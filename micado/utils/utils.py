@@ -3,10 +3,12 @@ import logging.config
 import os
 import string
 import secrets
+from datetime import datetime, timezone
 from pathlib import Path
 
 from Crypto.PublicKey import RSA
-from ruamel.yaml import YAML
+
+from micado.utils.store import get_store, import_yaml
 
 DEFAULT_PATH = Path.home() / ".micado-cli"
 
@@ -30,6 +32,11 @@ logger.addHandler(fh)
 
 
 class DataHandling:
+    """Records of MiCADO nodes and baked images, in the node store of a
+    data file (see utils.store). The backend is chosen with the
+    MICADO_STORE environment variable: "yaml" (default) or "sqlite".
+    """
+
     @staticmethod
     def persist_data(path, server_id, **kwargs):
         """Persist data to in a file
@@ -38,29 +45,7 @@ class DataHandling:
             path (string): Persist file location
             server_id (string): MiCADO UUID
         """
-        content = None
-        data = list()
-        args = dict()
-        for key, value in kwargs.items():
-            args[key] = value
-        data.append({server_id: args})
-        yaml = YAML()
-        yaml.indent(mapping=2, sequence=4, offset=2)
-        if os.path.isfile(path):
-            logger.debug("Data file exist...")
-            with open(path) as f:
-                content = yaml.load(f)
-            # Handle edge cases when the file is empty or it has syntax error
-            try:
-                content["micados"] += data
-            except:
-                content = dict()
-                content["micados"] = data
-        else:
-            logger.debug("Data file does not exist. Creating new file...")
-            content = {"micados": data}
-        with open(path, "w") as f:
-            yaml.dump(content, f)
+        get_store(path).persist_data(server_id, **kwargs)
 
     @staticmethod
     def get_properties(path, server_id):
@@ -71,24 +56,12 @@ class DataHandling:
             server_id (string): MiCADO UUID
 
         Raises:
-            Exception: return with exception when the uuid can't find in the file
+            LookupError: return with exception when the uuid can't find in the file
 
         Returns:
             (string): server properties
         """
-        yaml = YAML()
-        content = None
-        try:
-            with open(path, mode="r") as f:
-                content = yaml.load(f)
-        except Exception as e:
-            raise e
-        search = [i for i in content["micados"] if i.get(server_id, None)]
-        if not search:
-            logger.error("Can't find {} record!".format(server_id))
-            raise LookupError("Can't find property!")
-        else:
-            return search[0][server_id]
+        return get_store(path).get_properties(server_id)
 
     @staticmethod
     def update_data(path, server_id, **kwargs):
@@ -97,27 +70,117 @@ class DataHandling:
         Args:
             path (string): File location
             server_id (string): MiCADO UUID
+
+        Raises:
+            LookupError: the uuid can't be found in the file
+        """
+        get_store(path).update_data(server_id, **kwargs)
+
+    @staticmethod
+    def get_records(path):
+        """Return the properties of every server in the file.
+
+        Args:
+            path (string): File location
+
+        Returns:
+            (dict): server properties by MiCADO UUID
+        """
+        return get_store(path).get_records()
+
+    @staticmethod
+    def remove_data(path, server_ids):
+        """Remove several UUIDs from the file with a single write.
+
+        Args:
+            path (string): File location
+            server_ids (list): MiCADO UUIDs
+
+        Returns:
+            (dict): properties of the removed servers by MiCADO UUID
+        """
+        return get_store(path).remove_data(server_ids)
+
+    @staticmethod
+    def persist_image(path, version, image_id, **kwargs):
+        """Record a baked MiCADO image in the file.
+
+        Args:
+            path (string): File location
+            version (string): MiCADO version installed on the image
+            image_id (string): ID of the image in the cloud
         """
-        content = None
-        args = dict()
-        for key, value in kwargs.items():
-            args[key] = value
-        args = {server_id: args}
-        yaml = YAML()
-        yaml.indent(mapping=2, sequence=4, offset=2)
-        if os.path.isfile(path):
-            logger.debug("Data file exist...")
-            with open(path) as f:
-                content = yaml.load(f)
-            server = DataHandling.get_properties(path, server_id)
-            args[server_id].update(server)
-            for i in content["micados"]:
-                if i.get(server_id, None) != None:
-                    i.update(args)
-                    logger.debug("Data updated...")
-                    break
-        with open(path, "w") as f:
-            yaml.dump(content, f)
+        get_store(path).persist_image(version, image_id=image_id, **kwargs)
+
+    @staticmethod
+    def get_image(path, version, **kwargs):
+        """Return the most recent baked image for a MiCADO version.
+
+        Args:
+            path (string): File location
+            version (string): MiCADO version installed on the image
+            kwargs: Properties the image record must match (e.g. auth_url)
+
+        Raises:
+            LookupError: No matching image is recorded
+
+        Returns:
+            (string): image ID
+        """
+        for record in reversed(get_store(path).get_images(version)):
+            if all(record.get(k) == v for k, v in kwargs.items()):
+                return record["image_id"]
+        logger.error("Can't find baked image for MiCADO {}!".format(version))
+        raise LookupError("Can't find baked image!")
+
+    @staticmethod
+    def import_yaml(path):
+        """Import a YAML data file into the SQLite node store next to it.
+
+        Importing the same file again changes nothing.
+
+        Args:
+            path (string): YAML data file location
+
+        Returns:
+            (int): number of MiCADO records imported
+        """
+        return import_yaml(path)
+
+    @staticmethod
+    def restore_data(path, records):
+        """Persist removed records again, e.g. when deleting their VM failed
+
+        Args:
+            path (string): File location
+            records (dict): Properties returned by remove_data, by MiCADO UUID
+        """
+        if not records:
+            return
+        with get_store(path).batch() as store:
+            for server_id, properties in records.items():
+                store.persist_data(server_id, **properties)
+
+    @staticmethod
+    def batch(path):
+        """Make several changes to the node store at once, e.g.
+
+            >>> with DataHandling.batch(path) as store:
+            ...     for server_id in server_ids:
+            ...         store.update_data(server_id, phase="launched")
+
+        The YAML store is locked and rewritten only once, and the SQLite
+        store changes in a single transaction. Nothing is written if the
+        block raises.
+
+        Args:
+            path (string): File location
+
+        Returns:
+            (contextmanager): yields the store, with the methods of
+                DataHandling less the path argument
+        """
+        return get_store(path).batch()
 
 
 class SSHKeyHandling:
@@ -156,6 +219,19 @@ class SSHKeyHandling:
         os.chmod(home + "micado_cli_config_priv_key", 0o600)
         os.chmod(home + "micado_cli_config_pub_key", 0o666)
 
+def seconds_since(timestamp):
+    """Return the seconds elapsed since an ISO 8601 timestamp, e.g. the
+    creation time of a server. Timestamps without a timezone are UTC.
+
+    Raises:
+        ValueError: When the timestamp cannot be parsed
+    """
+    created = datetime.fromisoformat(str(timestamp).strip().replace("Z", "+00:00"))
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
+
 def generate_password():
     alphabet = string.ascii_letters + string.digits
     password = "".join(secrets.choice(alphabet) for i in range(14))
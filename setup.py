@@ -7,14 +7,12 @@ with open("README.md") as file:
 REQUIREMENTS = [
     "requests",
     "ruamel.yaml",
-    "paramiko",
     "pycryptodome",
     "python-novaclient",
     "openstacksdk",
     "ansible",
     "ansible-runner",
     "click",
-    "dicttoxml",
 ]
 
 setup(
@@ -0,0 +1,248 @@
+import contextlib
+import types
+from pathlib import Path
+
+import pytest
+
+from micado.installer.ansible import ansible
+from micado.installer.ansible.ansible import HOST_SECURITY, AnsibleInstaller
+from micado.utils.utils import DataHandling
+
+NODES = [types.SimpleNamespace(id=f"node-{i}", ip=f"10.0.0.{i}") for i in range(3)]
+
+
+class Playbook:
+    runs = []
+    stats = None
+    rc = 0
+
+    def __init__(self, version, id, home):
+        self.playbook_path = Path(f"{home}micado-{version}")
+
+    def playbook_exists(self):
+        return True
+
+    def run(self, hosts, extravars, **kwargs):
+        self.runs.append((hosts, extravars))
+        return types.SimpleNamespace(stats=self.stats, rc=self.rc)
+
+
+@pytest.fixture
+def installer(tmp_path, monkeypatch):
+    monkeypatch.setattr(Playbook, "runs", [])
+    monkeypatch.setattr(Playbook, "stats", {"failures": {}, "dark": {}})
+    monkeypatch.setattr(ansible, "Playbook", Playbook)
+    monkeypatch.setattr(AnsibleInstaller, "home", f"{tmp_path}/")
+    monkeypatch.setattr(AnsibleInstaller, "micado_version", "v0.12.6")
+    monkeypatch.setattr(ansible, "micado_cli_dir", tmp_path)
+
+    settings = tmp_path / "micado-v0.12.6/playbook/project/host_vars/micado.yml"
+    settings.parent.mkdir(parents=True)
+    settings.write_text("docker_cri: containerd\nansible_user: root\n")
+    for node in NODES:
+        DataHandling.persist_data(f"{tmp_path}/data.yml", node.id, ip=node.ip)
+
+    installer = AnsibleInstaller()
+    installer.checked = []
+    installer._check_availability = lambda ip: contextlib.nullcontext(
+        types.SimpleNamespace(ansible_ssh_args="-o ControlPath=x")
+    )
+    installer._check_submitter = lambda ip, *creds: installer.checked.append(ip)
+    installer._get_self_signed_cert = lambda ssh, id: None
+    return installer
+
+
+def stored_password(tmp_path, id):
+    return DataHandling.get_properties(f"{tmp_path}/data.yml", id)["micado_password"]
+
+
+def test_hosts_get_the_settings_and_credentials_as_extravars(tmp_path, installer):
+    results = installer.deploy_many(NODES)
+
+    assert results == {node.id: "Deployed" for node in NODES}
+    inventory, extravars = Playbook.runs[0]
+    hosts = inventory["all"]["children"]["micado"]["hosts"]
+    for node in NODES:
+        host = hosts[node.id]
+        assert host["docker_cri"] == "containerd"
+        assert host["ansible_user"] == "ubuntu"
+        password = host[HOST_SECURITY]["authentication"]["password"]
+        assert password == stored_password(tmp_path, node.id)
+    assert extravars["security"] == "{{ %s }}" % HOST_SECURITY
+    assert extravars["enable_terraform"] is True
+
+
+def test_failed_and_unreachable_hosts_are_reported(tmp_path, installer, monkeypatch):
+    stats = {"failures": {"node-0": 1, "node-2": 0}, "dark": {"node-1": 1}}
+    monkeypatch.setattr(Playbook, "stats", stats)
+    results = installer.deploy_many(NODES)
+
+    assert results == {
+        "node-0": "Failed: playbook",
+        "node-1": "Failed: playbook",
+        "node-2": "Deployed",
+    }
+    assert installer.checked == ["10.0.0.2"]
+    assert stored_password(tmp_path, "node-0")  # kept to fix and re-run the node
+
+
+def test_unavailable_hosts_are_left_out_of_the_run(installer):
+    session = types.SimpleNamespace(ansible_ssh_args="")
+
+    def check(ip):
+        if ip == "10.0.0.1":
+            raise RuntimeError("port 22 closed")
+        return contextlib.nullcontext(session)
+
+    installer._check_availability = check
+    results = installer.deploy_many(NODES)
+
+    assert results["node-1"] == "Failed: port 22 closed"
+    assert results["node-0"] == results["node-2"] == "Deployed"
+    inventory, _ = Playbook.runs[0]
+    assert list(inventory["all"]["children"]["micado"]["hosts"]) == ["node-0", "node-2"]
+
+
+@pytest.mark.parametrize("stats", [None, {}])
+@pytest.mark.parametrize("rc, deployed", [(0, True), (2, False)])
+def test_missing_stats_follow_the_return_code(installer, monkeypatch, stats, rc, deployed):
+    monkeypatch.setattr(Playbook, "stats", stats)
+    monkeypatch.setattr(Playbook, "rc", rc)
+    results = installer.deploy_many(NODES)
+
+    expected = "Deployed" if deployed else "Failed: playbook"
+    assert results == {node.id: expected for node in NODES}
+
+
+class Session:
+    keys = []
+
+    def __init__(self, ip, user, key_file):
+        self.closed = False
+
+    def open(self):
+        return self
+
+    def host_keys(self):
+        return self.keys
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("keys", [[], ["10.0.0.1 ssh-ed25519 KEY\n"]])
+def test_known_hosts_only_updated_with_new_keys(installer, monkeypatch, keys):
+    updates = []
+    monkeypatch.setattr(Session, "keys", keys)
+    monkeypatch.setattr(ansible, "SSHSession", Session)
+    monkeypatch.setattr(ansible, "update_known_host", lambda *args: updates.append(args))
+
+    ssh = installer._check_ssh_availability("10.0.0.1")
+    assert not ssh.closed
+    assert updates == ([("10.0.0.1", keys)] if keys else [])
+
+
+def test_session_closed_when_known_hosts_update_fails(installer, monkeypatch):
+    sessions = []
+
+    def session(*args):
+        sessions.append(Session(*args))
+        return sessions[-1]
+
+    def update(*args):
+        raise PermissionError("known_hosts")
+
+    monkeypatch.setattr(Session, "keys", ["10.0.0.1 ssh-ed25519 KEY\n"])
+    monkeypatch.setattr(ansible, "SSHSession", session)
+    monkeypatch.setattr(ansible, "update_known_host", update)
+
+    with pytest.raises(PermissionError):
+        installer._check_ssh_availability("10.0.0.1")
+    assert sessions[0].closed
+
+
+@pytest.mark.parametrize(
+    "baked, tags, expected",
+    [
+        (True, None, ansible.START_TAGS),
+        (False, None, None),
+        (False, ansible.AUTH_TAGS, ansible.AUTH_TAGS),
+    ],
+)
+def test_deploy_runs_only_the_tags_needed(installer, baked, tags, expected):
+    runs = []
+    installer._check_port_availability = lambda ip, *ports: {}
+    installer._check_ssh_availability = lambda ip: contextlib.nullcontext(
+        types.SimpleNamespace(ansible_ssh_args="")
+    )
+    installer._run_playbook = lambda id, hosts, extravars, *args, **kwargs: runs.append(
+        args[0] if args else None
+    )
+
+    installer.deploy(NODES[0], baked=baked, tags=tags)
+    assert runs == [expected]
+
+
+def test_claim_tags_apply_the_new_password(tmp_path, installer):
+    from micado.models.pool import CLAIM_TAGS
+
+    runs = []
+    installer._check_port_availability = lambda ip, *ports: {}
+    installer._check_ssh_availability = lambda ip: contextlib.nullcontext(
+        types.SimpleNamespace(ansible_ssh_args="")
+    )
+
+    def run_playbook(id, hosts, extravars, tags, *args, **kwargs):
+        runs.append((tags, extravars["security"]["authentication"]))
+
+    installer._run_playbook = run_playbook
+    installer._check_submitter = lambda ip, *creds: installer.checked.append(creds)
+    DataHandling.update_data(f"{tmp_path}/data.yml", "node-0", micado_password="warm")
+
+    installer.deploy(NODES[0], phase="ports_open", tags=CLAIM_TAGS)
+    password = stored_password(tmp_path, "node-0")
+    assert password != "warm"
+    assert runs == [(ansible.START_TAGS, {"username": "admin", "password": password})]
+    assert installer.checked == [("admin", password)]
+
+
+@pytest.mark.parametrize("status, fails", [(200, False), (401, True)])
+def test_submitter_check_needs_a_200(installer, monkeypatch, status, fails):
+    class Session:
+        def mount(self, prefix, adapter):
+            pass
+
+        def get(self, url):
+            return types.SimpleNamespace(status_code=status)
+
+    monkeypatch.setattr(ansible.requests, "Session", Session)
+    installer._check_port_availability = lambda ip, *ports: {}
+    check_submitter = AnsibleInstaller._check_submitter.__get__(installer)
+    if fails:
+        with pytest.raises(ansible.MicadoException, match="401"):
+            check_submitter("10.0.0.1", "admin", "pw")
+    else:
+        check_submitter("10.0.0.1", "admin", "pw")
+
+
+def test_settings_changes_rerun_the_whole_playbook(tmp_path, installer, monkeypatch):
+    tags = []
+
+    def run_playbook(self, hosts, extravars, **kwargs):
+        tags.append(kwargs["tags"])
+        return types.SimpleNamespace(rc=0)
+
+    monkeypatch.setattr(Playbook, "run", run_playbook)
+    hosts = installer._generate_inventory("10.0.0.1")
+    extravars = installer._generate_extravars("admin", "pw", True, False, True)
+    run = lambda: installer._run_playbook("node-0", hosts, extravars)
+
+    run()
+    run()
+    assert tags == [None]
+    for folder in ("host_vars/micado.yml", "group_vars/all.yml"):
+        path = tmp_path / "micado-v0.12.6/playbook/project" / folder
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("docker_cri: dockershim\n")
+        run()
+    assert tags == [None, None, None]
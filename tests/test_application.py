@@ -0,0 +1,28 @@
+import threading
+import time
+
+from micado.api.client import SubmitterClient
+
+
+def test_destroy_deletes_apps_concurrently_within_deadline(monkeypatch):
+    api = SubmitterClient("https://micado/toscasubmitter/")
+    running = []
+    lock = threading.Lock()
+
+    def delete_app(app_id, force=False, timeout=None):
+        with lock:
+            running.append(app_id)
+        if app_id == "stuck":
+            time.sleep(1)
+        if app_id == "broken":
+            raise ConnectionError
+        return {"id": app_id}
+
+    monkeypatch.setattr(api, "applications", lambda: ["a", "b", "stuck", "broken"])
+    monkeypatch.setattr(api, "delete_app", delete_app)
+
+    start = time.monotonic()
+    remaining = api._destroy(timeout=0.2)
+    assert time.monotonic() - start < 0.5
+    assert sorted(running) == ["a", "b", "broken", "stuck"]
+    assert sorted(remaining) == ["broken", "stuck"]
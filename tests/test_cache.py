@@ -0,0 +1,174 @@
+import hashlib
+import io
+import tarfile
+import types
+
+import pytest
+
+from micado.installer.ansible import cache
+
+
+def make_tarball():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        data = b"- hosts: all\n"
+        info = tarfile.TarInfo("micado-scale-ansible-micado-abc/playbook/micado.yml")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class Response:
+    def __init__(self, body, status_code=200):
+        self.raw = io.BytesIO(body)
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    body = make_tarball()
+    calls = types.SimpleNamespace(urls=[], sha256=hashlib.sha256(body).hexdigest())
+
+    def get(url, **kwargs):
+        calls.urls.append(url)
+        return Response(body)
+
+    monkeypatch.setattr(cache.requests, "get", get)
+    return calls
+
+
+def test_downloads_once_per_version(tmp_path, downloads):
+    tarballs = cache.TarballCache(tmp_path)
+    first = tarballs.get("v0.12.6")
+    second = tarballs.get("v0.12.6")
+    assert first == second == tmp_path / "tarballs" / f"{downloads.sha256}.tar.gz"
+    assert len(downloads.urls) == 1
+
+
+def test_corrupt_tarball_is_downloaded_again(tmp_path, downloads):
+    tarballs = cache.TarballCache(tmp_path)
+    tarballs.get("v0.12.6").write_bytes(b"corrupt")
+    assert cache.file_digest(tarballs.get("v0.12.6")) == downloads.sha256
+    assert len(downloads.urls) == 2
+
+
+def test_tarball_not_matching_its_checksum_is_downloaded_again(tmp_path, downloads):
+    tarballs = cache.TarballCache(tmp_path)
+    path = tarballs.get("v0.12.6")
+    body = bytearray(path.read_bytes())
+    body[-1] ^= 0xFF  # same size, different content
+    path.write_bytes(body)
+    assert cache.file_digest(tarballs.get("v0.12.6")) == downloads.sha256
+    assert len(downloads.urls) == 2
+
+
+def test_download_not_written_intact_is_not_installed(tmp_path, downloads, monkeypatch):
+    monkeypatch.setattr(cache, "file_digest", lambda path: "0" * 64)
+    with pytest.raises(TypeError):
+        cache.TarballCache(tmp_path).get("v0.12.6")
+    assert not list((tmp_path / "tarballs").iterdir())
+    assert not (tmp_path / "versions" / "v0.12.6").exists()
+
+
+def test_corrupt_download_is_not_installed(tmp_path, monkeypatch):
+    from micado.installer.ansible.playbook import extract_stream
+
+    body = make_tarball()
+    monkeypatch.setattr(cache.requests, "get", lambda url, **kw: Response(body + b"junk"))
+    monkeypatch.setattr(cache.tarfile, "is_tarfile", lambda path: False)
+
+    with pytest.raises(TypeError):
+        with cache.TarballCache(tmp_path / "cache").stream("v0.12.6") as stream:
+            extract_stream(stream, tmp_path / "micado-v0.12.6", verify=stream.verify)
+    assert not (tmp_path / "micado-v0.12.6").exists()
+    assert not list((tmp_path / "cache" / "tarballs").iterdir())
+    assert not (tmp_path / "cache" / "versions" / "v0.12.6").exists()
+
+
+def test_missing_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache.requests, "get", lambda url, **kw: Response(b"", 404))
+    with pytest.raises(TypeError):
+        cache.TarballCache(tmp_path).get("v0.0.0")
+
+
+def test_stream_extracts_while_caching(tmp_path, downloads):
+    from micado.installer.ansible.playbook import extract_stream
+
+    tarballs = cache.TarballCache(tmp_path / "cache")
+    with tarballs.stream("v0.12.6") as stream:
+        extract_stream(stream, tmp_path / "micado-v0.12.6", verify=stream.verify)
+
+    assert (tmp_path / "micado-v0.12.6/playbook/micado.yml").read_bytes() == b"- hosts: all\n"
+    assert stream.path == tmp_path / "cache" / "tarballs" / f"{downloads.sha256}.tar.gz"
+    assert len(downloads.urls) == 1
+
+
+def test_extract_skips_members_outside_the_target(tmp_path):
+    from micado.installer.ansible.playbook import extract_stream
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name in ("top/../../evil", "/top/abs", "top/ok"):
+            info = tarfile.TarInfo(name)
+            tar.addfile(info, io.BytesIO())
+        for name, linkname in (("top/link", "/etc/passwd"), ("top/up", "../../x")):
+            link = tarfile.TarInfo(name)
+            link.type, link.linkname = tarfile.SYMTYPE, linkname
+            tar.addfile(link)
+        fifo = tarfile.TarInfo("top/fifo")
+        fifo.type = tarfile.FIFOTYPE
+        tar.addfile(fifo)
+    buffer.seek(0)
+
+    extract_stream(buffer, tmp_path / "out" / "micado")
+    assert sorted(p.name for p in (tmp_path / "out").rglob("*")) == ["micado", "ok"]
+    assert not (tmp_path / "evil").exists()
+
+
+def test_extract_keeps_links_inside_the_tree(tmp_path):
+    from micado.installer.ansible.playbook import extract_stream
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        info = tarfile.TarInfo("top/roles/common/tasks.yml")
+        tar.addfile(info, io.BytesIO())
+        link = tarfile.TarInfo("top/roles/docker/tasks.yml")
+        link.type, link.linkname = tarfile.SYMTYPE, "../common/tasks.yml"
+        tar.addfile(link)
+        hard = tarfile.TarInfo("top/tasks.yml")
+        hard.type, hard.linkname = tarfile.LNKTYPE, "top/roles/common/tasks.yml"
+        tar.addfile(hard)
+    buffer.seek(0)
+
+    extract_stream(buffer, tmp_path / "micado")
+    link = tmp_path / "micado/roles/docker/tasks.yml"
+    assert link.is_symlink() and link.resolve() == tmp_path / "micado/roles/common/tasks.yml"
+    assert (tmp_path / "micado/tasks.yml").is_file()
+
+
+def test_extract_reports_rename_errors(tmp_path, monkeypatch):
+    from micado.installer.ansible import playbook
+
+    def rename(src, dst):
+        raise PermissionError(13, "Permission denied")
+
+    monkeypatch.setattr(playbook.os, "rename", rename)
+    with pytest.raises(PermissionError):
+        playbook.extract_stream(io.BytesIO(make_tarball()), tmp_path / "micado")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_extract_leaves_an_existing_target(tmp_path):
+    from micado.installer.ansible.playbook import extract_stream
+
+    (tmp_path / "micado").mkdir()
+    (tmp_path / "micado" / "old").touch()
+    extract_stream(io.BytesIO(make_tarball()), tmp_path / "micado")
+    assert [p.name for p in tmp_path.iterdir()] == ["micado"]
+    assert [p.name for p in (tmp_path / "micado").iterdir()] == ["old"]
@@ -0,0 +1,281 @@
+import base64
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from micado.exceptions import MicadoException
+from micado.launcher.cloudbroker import cloudbroker
+from micado.launcher.cloudbroker.cloudbroker import (
+    CloudBrokerLauncher,
+    InstanceInfo,
+    instance_xml,
+    parse_instance,
+    parse_instances,
+)
+
+INSTANCE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<instance>
+  <id>i-1</id>
+  <name>MiCADO-node</name>
+  <status>running</status>
+  <deployment><id>d-1</id><status>active</status></deployment>
+  <external-ip-address>192.0.2.10</external-ip-address>
+</instance>"""
+
+INSTANCE_DESCR = {
+    "deployment_id": "dep-1",
+    "instance_type_id": 42,
+    "key_pair_id": "key & <pair>",
+    "firewall_rule_set_id": "fw-\"1'",
+    "disable_autostop": "true",
+    "isolated": "true",
+    "name": "MiCADO-café",
+    "cloud-init": "I2Nsb3VkLWNvbmZpZw==",
+    "cloud-init-b64": "true",
+}
+
+
+def instance_doc(status):
+    return InstanceInfo(id="i-1", status=status)
+
+
+def test_parse_instance():
+    assert parse_instance(INSTANCE_XML) == InstanceInfo(
+        id="i-1", status="running", ip="192.0.2.10", name="MiCADO-node"
+    )
+
+
+def test_instance_xml():
+    assert instance_xml(INSTANCE_DESCR) == (
+        b'<?xml version="1.0" encoding="UTF-8" ?><instance>'
+        b"<deployment_id>dep-1</deployment_id>"
+        b"<instance_type_id>42</instance_type_id>"
+        b"<key_pair_id>key &amp; &lt;pair&gt;</key_pair_id>"
+        b"<firewall_rule_set_id>fw-&quot;1&apos;</firewall_rule_set_id>"
+        b"<disable_autostop>true</disable_autostop>"
+        b"<isolated>true</isolated>"
+        b"<name>MiCADO-caf\xc3\xa9</name>"
+        b"<cloud-init>I2Nsb3VkLWNvbmZpZw==</cloud-init>"
+        b"<cloud-init-b64>true</cloud-init-b64>"
+        b"</instance>"
+    )
+
+
+def test_instance_xml_matches_dicttoxml():
+    dicttoxml = pytest.importorskip("dicttoxml").dicttoxml
+    expected = dicttoxml(INSTANCE_DESCR, custom_root="instance", attr_type=False)
+    assert instance_xml(INSTANCE_DESCR) == expected
+
+
+def test_parse_instances_ignores_nested_elements():
+    body = INSTANCE_XML.split("\n", 1)[1]
+    xml = f"<instances>{body}{body.replace('i-1', 'i-2')}</instances>"
+    assert [i.id for i in parse_instances(xml)] == ["i-1", "i-2"]
+
+
+@pytest.fixture
+def launcher(monkeypatch):
+    monkeypatch.setattr(cloudbroker, "sleep", lambda seconds: None)
+    monkeypatch.setattr(cloudbroker, "POLL_FIRST", 0)
+    return CloudBrokerLauncher()
+
+
+def poll_statuses(monkeypatch, launcher, statuses):
+    docs = iter(instance_doc(status) for status in statuses)
+    monkeypatch.setattr(
+        launcher, "get_instance", lambda url, id, attempts=5: next(docs)
+    )
+
+
+def test_wait_for_instance_reports_transitions(monkeypatch, launcher):
+    poll_statuses(monkeypatch, launcher, ["starting", "starting", "running"])
+    changes = []
+    launcher.wait_for_instance(
+        "url", "i-1", on_status=lambda *change: changes.append(change)
+    )
+    assert changes == [("i-1", None, "starting"), ("i-1", "starting", "running")]
+
+
+def test_wait_for_instance_fails_fast(monkeypatch, launcher):
+    poll_statuses(monkeypatch, launcher, ["starting", "failed", "running"])
+    with pytest.raises(MicadoException, match="failed"):
+        launcher.wait_for_instance("url", "i-1")
+
+
+def test_wait_for_instance_deadline(monkeypatch, launcher):
+    monkeypatch.setattr(
+        launcher, "get_instance", lambda url, id, attempts=5: instance_doc("starting")
+    )
+    with pytest.raises(MicadoException, match="not running"):
+        launcher.wait_for_instance("url", "i-1", timeout=0)
+
+
+class CollectionSession:
+    def __init__(self, ids, polls_until_running):
+        self.ids = ids
+        self.polls = 0
+        self.polls_until_running = polls_until_running
+        self.polled = []  # IDs asked for by each poll
+
+    @property
+    def status(self):
+        return "running" if self.polls >= self.polls_until_running else "starting"
+
+    def get(self, url, params=None):
+        assert url.endswith("/instances.xml")
+        self.polls += 1
+        self.polled.append(set(params["id"].split(",")))
+        status = self.status
+        body = "".join(
+            f"<instance><id>{i}</id><status>{status}</status></instance>"
+            for i in self.ids + ["other"]
+        )
+        return type("Response", (), {"status_code": 200, "text": f"<instances>{body}</instances>"})
+
+
+def test_tracker_polls_collection_for_many_instances(monkeypatch, launcher):
+    ids = ["i-1", "i-2", "i-3"]
+    session = CollectionSession(ids, polls_until_running=3)
+    monkeypatch.setattr(CloudBrokerLauncher, "session", session)
+    monkeypatch.setattr(
+        launcher,
+        "get_instance",
+        lambda url, id, attempts=5: session.polled.append({id})
+        or instance_doc(session.status),
+    )
+    started = threading.Barrier(len(ids))
+    results = {}
+
+    def wait(instanceid):
+        started.wait()
+        results[instanceid] = launcher.wait_for_instance("url", instanceid, timeout=10)
+
+    threads = [threading.Thread(target=wait, args=(i,)) for i in ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {i: r.status for i, r in results.items()} == dict.fromkeys(ids, "running")
+    assert session.polls >= 3
+    # waiters that see "running" stop being polled, so later polls ask for
+    # fewer, and a lone waiter is polled directly
+    assert all(polled <= set(ids) for polled in session.polled)
+    assert set().union(*session.polled) == set(ids)
+
+
+@pytest.mark.parametrize("waiters", [2, 10])
+def test_tracker_poll_rate_is_flat(monkeypatch, launcher, waiters):
+    monkeypatch.setattr(cloudbroker, "POLL_FIRST", 0.05)
+    monkeypatch.setattr(cloudbroker, "POLL_FACTOR", 1)
+    ids = [f"i-{i}" for i in range(waiters)]
+    session = CollectionSession(ids, polls_until_running=5)
+    monkeypatch.setattr(CloudBrokerLauncher, "session", session)
+    singles = []
+    monkeypatch.setattr(
+        launcher,
+        "get_instance",
+        lambda url, id, attempts=5: singles.append(id) or instance_doc("starting"),
+    )
+    threads = [
+        threading.Thread(target=launcher.wait_for_instance, args=("url", i, 10))
+        for i in ids
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)  # join at different times within the first interval
+    for thread in threads:
+        thread.join()
+
+    # one request per interval until running, whatever the number of waiters
+    assert session.polls + len(singles) <= 6
+
+
+def test_credentials_cached_until_file_changes(tmp_path, monkeypatch, launcher):
+    creds = tmp_path / "credentials-cloud-api.yml"
+    template = "resource:\n- type: cloudbroker\n  auth_data:\n    email: {}\n    password: pw\n"
+    creds.write_text(template.format("a@example.com"))
+    monkeypatch.setattr(launcher, "home", f"{tmp_path}/")
+    reads = []
+    original = launcher._get_credentials
+    monkeypatch.setattr(
+        launcher, "_get_credentials", lambda: reads.append(1) or original()
+    )
+
+    assert launcher.get_auth() == ("a@example.com", "pw")
+    assert authorization(launcher) == basic("a@example.com", "pw")
+    assert len(reads) == 1
+
+    creds.write_text(template.format("b@example.com"))
+    stat = creds.stat()
+    os.utime(creds, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert authorization(launcher) == basic("b@example.com", "pw")
+    assert len(reads) == 2
+
+
+def authorization(launcher):
+    request = requests.Request("GET", "https://cloudbroker/instances.xml")
+    return launcher.session.prepare_request(request).headers["Authorization"]
+
+
+def basic(user, password):
+    return "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+
+def test_session_access_does_not_read_credentials(monkeypatch, launcher):
+    monkeypatch.setattr(
+        launcher, "get_auth", lambda: pytest.fail("credentials read")
+    )
+    for _ in range(3):
+        assert launcher.session is launcher.session
+
+
+class StopSession:
+    def __init__(self, instances=""):
+        self.stopped = []
+        self.instances = instances
+
+    def get(self, url):
+        return type("Response", (), {"status_code": 200, "text": self.instances})
+
+    def put(self, url):
+        self.stopped.append(url)
+        status = 500 if "/i-bad/" in url else 200
+        return type("Response", (), {"status_code": status, "text": ""})
+
+
+def test_delete_many_keeps_records_of_failed_stops(tmp_path, monkeypatch, launcher):
+    from micado.utils.utils import DataHandling
+
+    session = StopSession()
+    monkeypatch.setattr(CloudBrokerLauncher, "session", session)
+    monkeypatch.setattr(launcher, "home", f"{tmp_path}/")
+    for id in ("i-ok", "i-bad"):
+        DataHandling.persist_data(f"{tmp_path}/data.yml", id, auth_url="https://cb")
+
+    results = launcher.delete_many(["i-ok", "i-bad", "unknown"])
+    assert results == {"i-ok": "Destroyed", "i-bad": "Failed: 500", "unknown": "Not found"}
+    assert len(session.stopped) == 2
+    assert list(DataHandling.get_records(f"{tmp_path}/data.yml")) == ["i-bad"]
+
+
+def test_sweep_leaves_young_instances(tmp_path, monkeypatch, launcher):
+    ids = {"old": "a" * 32, "young": "b" * 32, "undated": "c" * 32}
+    created = {
+        "old": "2020-01-01T00:00:00Z",
+        "young": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "undated": "",
+    }
+    body = "".join(
+        f"<instance><id>{ids[key]}</id><name>MiCADO-{ids[key]}</name>"
+        f"<status>running</status><created-at>{created[key]}</created-at></instance>"
+        for key in ids
+    )
+    session = StopSession(f"<instances>{body}</instances>")
+    monkeypatch.setattr(CloudBrokerLauncher, "session", session)
+    monkeypatch.setattr(launcher, "home", f"{tmp_path}/")
+
+    assert launcher.sweep("https://cb") == {ids["old"]: "Destroyed"}
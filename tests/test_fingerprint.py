@@ -0,0 +1,43 @@
+from micado.installer.ansible.fingerprint import (
+    FULL_RUN,
+    Fingerprints,
+    fingerprint_data,
+    fingerprint_file,
+    join_tags,
+)
+
+INPUT_TAGS = {"cloud": "update-auth", "registry": "update-auth"}
+CURRENT = {"hosts": "a", "extravars": "b", "cloud": "c", "registry": "d"}
+
+
+def test_first_run_is_full(tmp_path):
+    fingerprints = Fingerprints(tmp_path / "fp.json", INPUT_TAGS)
+    assert fingerprints.changed_tags(CURRENT) is FULL_RUN
+
+
+def test_only_changed_tags_run(tmp_path):
+    fingerprints = Fingerprints(tmp_path / "fp.json", INPUT_TAGS)
+    fingerprints.save(CURRENT)
+    assert fingerprints.changed_tags(CURRENT) == set()
+    assert fingerprints.changed_tags(CURRENT, full=True) is FULL_RUN
+
+    changed = dict(CURRENT, cloud="new", registry="new")
+    assert join_tags(fingerprints.changed_tags(changed)) == "update-auth"
+    assert fingerprints.changed_tags(dict(changed, hosts="new")) is FULL_RUN
+
+
+def test_tagged_run_saves_only_its_inputs(tmp_path):
+    fingerprints = Fingerprints(tmp_path / "fp.json", INPUT_TAGS)
+    fingerprints.save(CURRENT)
+    changed = dict(CURRENT, cloud="new", hosts="new")
+    fingerprints.save(changed, {"update-auth"})
+    assert fingerprints.load() == dict(CURRENT, cloud="new")
+
+
+def test_fingerprints_ignore_key_order_and_volatile_keys(tmp_path):
+    first = {"micado": {"ansible_host": "1.2.3.4", "ansible_ssh_common_args": "x"}}
+    second = {"micado": {"ansible_ssh_common_args": "y", "ansible_host": "1.2.3.4"}}
+    ignore = ("ansible_ssh_common_args",)
+    assert fingerprint_data(first, ignore) == fingerprint_data(second, ignore)
+    assert fingerprint_data(first) != fingerprint_data(second)
+    assert fingerprint_file(tmp_path / "missing.yml") is None
@@ -0,0 +1,201 @@
+import time
+import types
+
+import pytest
+
+from micado.exceptions import MicadoException
+from micado.models.micado import Micado
+from micado.utils.utils import DataHandling
+
+
+class Installer:
+    micado_version = "v0.12.6"
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.deploys = []
+
+    def deploy(self, micado, phase=None, checkpoint=None, **kwargs):
+        self.deploys.append((phase, kwargs.get("micado_password")))
+        for step in ("ports_open", "playbook_done", "cert_fetched"):
+            if step == self.fail_at:
+                raise RuntimeError(step)
+            checkpoint(step)
+
+
+class Api:
+    reachable = True
+
+    def applications(self):
+        if not self.reachable:
+            raise ConnectionError("submitter unreachable")
+        return []
+
+
+@pytest.fixture
+def micado(tmp_path, monkeypatch):
+    launcher = types.SimpleNamespace(deleted=[])
+    launcher.launch = lambda **kwargs: DataHandling.persist_data(
+        tmp_path / "data.yml", "abc", ip="1.2.3.4"
+    ) or types.SimpleNamespace(id="abc", ip="1.2.3.4")
+    launcher.delete = launcher.deleted.append
+    client = types.SimpleNamespace(launcher=launcher, installer=Installer("playbook_done"))
+    monkeypatch.setattr(Micado, "home", f"{tmp_path}/")
+    monkeypatch.setattr(Micado, "init_api", lambda self: Api())
+    return Micado(client=client)
+
+
+def phase(tmp_path):
+    return DataHandling.get_properties(tmp_path / "data.yml", "abc")["phase"]
+
+
+def test_failed_create_keeps_the_vm_and_resumes(tmp_path, micado):
+    with pytest.raises(RuntimeError):
+        micado.create(keep_on_failure=True)
+    assert phase(tmp_path) == "ports_open"
+    assert micado.launcher.deleted == []
+
+    DataHandling.update_data(tmp_path / "data.yml", "abc", micado_password="secret")
+    micado.client.installer.fail_at = None
+    assert micado.create(resume="abc") == "abc"
+    assert micado.client.installer.deploys[-1] == ("ports_open", "secret")
+    assert phase(tmp_path) == "api_verified"
+
+
+def test_api_checkpoint_needs_a_reachable_api(tmp_path, micado, monkeypatch):
+    monkeypatch.setattr(Api, "reachable", False)
+    micado.client.installer.fail_at = None
+    with pytest.raises(ConnectionError):
+        micado.create(keep_on_failure=True)
+    assert phase(tmp_path) == "cert_fetched"
+
+    monkeypatch.setattr(Api, "reachable", True)
+    assert micado.create(resume="abc") == "abc"
+    assert phase(tmp_path) == "api_verified"
+
+
+def test_failed_create_deletes_the_vm_by_default(micado):
+    with pytest.raises(RuntimeError):
+        micado.create()
+    assert micado.launcher.deleted == ["abc"]
+
+
+def test_update_data_overrides_existing_values(tmp_path):
+    DataHandling.persist_data(tmp_path / "data.yml", "abc", phase="launched")
+    DataHandling.update_data(tmp_path / "data.yml", "abc", phase="ports_open")
+    assert phase(tmp_path) == "ports_open"
+
+
+def test_prepare_overlaps_launch(tmp_path, micado):
+    launch = micado.launcher.launch
+
+    def slow(*args, **kwargs):
+        time.sleep(0.2)
+        return launch(*args, **kwargs)
+
+    micado.launcher.launch = slow
+    micado.client.installer.prepare = lambda **kwargs: time.sleep(0.2)
+    micado.client.installer.fail_at = None
+    micado.create()
+
+    timings = Micado(client=micado.client).timings
+    assert timings["prepare"][0] < timings["launch"][1]
+    assert timings["launch"][0] < timings["prepare"][1]
+    assert timings["launch"][1] <= timings["ports_open"][1] <= timings["api_verified"][1]
+
+
+def test_fast_destroy_skips_app_teardown(micado, monkeypatch):
+    def init_api(self):
+        raise LookupError("Can't find property!")  # e.g. creation failed early
+
+    monkeypatch.setattr(Micado, "init_api", init_api)
+    micado.micado_id = "abc"
+    with pytest.raises(MicadoException, match="leave_resources"):
+        micado.destroy(mode="fast")
+    assert micado.launcher.deleted == []
+    micado.destroy(mode="fast", leave_resources=True)
+    assert micado.launcher.deleted == ["abc"]
+    with pytest.raises(Exception, match="Unknown destroy mode"):
+        micado.destroy(mode="quick")
+
+
+@pytest.fixture
+def baker(tmp_path, micado):
+    launcher = micado.launcher
+    launcher.supports_snapshot = True
+    launcher.snapshot = lambda id, name: f"image-of-{id}"
+    micado.client.installer.builds = []
+    micado.client.installer.build = (
+        lambda _micado, **kwargs: micado.client.installer.builds.append(_micado.id)
+    )
+    return micado
+
+
+def test_bake_records_the_image_and_deletes_the_vm(tmp_path, baker):
+    assert baker.bake(auth_url="https://cloud") == "image-of-abc"
+    assert baker.client.installer.builds == ["abc"]
+    assert baker.launcher.deleted == ["abc"]
+    assert DataHandling.get_image(tmp_path / "data.yml", "v0.12.6") == "image-of-abc"
+
+
+def test_bake_deletes_the_vm_when_the_build_fails(tmp_path, baker):
+    def build(_micado, **kwargs):
+        raise RuntimeError("build")
+
+    baker.client.installer.build = build
+    with pytest.raises(RuntimeError):
+        baker.bake(auth_url="https://cloud")
+    assert baker.launcher.deleted == ["abc"]
+    with pytest.raises(LookupError):
+        DataHandling.get_image(tmp_path / "data.yml", "v0.12.6")
+
+
+def test_bake_refuses_launchers_without_snapshots(baker):
+    baker.launcher.supports_snapshot = False
+    baker.launcher.launch = lambda **kwargs: pytest.fail("launched")
+    with pytest.raises(MicadoException, match="cannot bake"):
+        baker.bake(auth_url="https://cloud")
+
+
+def test_create_baked_boots_the_recorded_image(tmp_path, micado):
+    launched = []
+    launch = micado.launcher.launch
+    micado.launcher.launch = lambda **kwargs: launched.append(kwargs) or launch(**kwargs)
+    deploys = []
+    micado.client.installer.deploy = (
+        lambda _micado, **kwargs: deploys.append(kwargs["baked"])
+    )
+    DataHandling.persist_image(
+        tmp_path / "data.yml", "v0.12.6", "img-1", auth_url="https://cloud"
+    )
+
+    micado.create(baked=True, auth_url="https://cloud", image="ubuntu")
+    assert launched[0]["image"] == "img-1"
+    assert deploys == [True]
+
+
+def test_baked_images_belong_to_a_region_and_project(tmp_path, baker):
+    scope = {"auth_url": "https://cloud", "region": "RegionOne", "project_id": "p1"}
+    baker.bake(**scope)
+    baker.client.installer.fail_at = None
+
+    for other in ({"region": "RegionTwo"}, {"project_id": "p2"}):
+        with pytest.raises(LookupError):
+            baker.create(baked=True, image="ubuntu", **dict(scope, **other))
+    assert baker.create(baked=True, image="ubuntu", **scope) == "abc"
+
+
+def test_claimed_node_gets_new_credentials(tmp_path, micado):
+    deploys = []
+    micado.client.installer.deploy = lambda _micado, **kwargs: deploys.append(kwargs)
+    micado.client.warm_pool = types.SimpleNamespace(
+        claim=lambda **kwargs: types.SimpleNamespace(id="abc", ip="1.2.3.4"),
+        replenish=lambda **kwargs: None,
+    )
+    micado.launcher.launch = lambda **kwargs: pytest.fail("launched")
+    DataHandling.persist_data(tmp_path / "data.yml", "abc", ip="1.2.3.4")
+
+    assert micado.create(auth_url="https://cloud") == "abc"
+    assert deploys[0]["tags"] == "start"
+    assert deploys[0]["phase"] == "ports_open"
+    assert "micado_password" not in deploys[0]  # generated by the installer
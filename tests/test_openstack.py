@@ -0,0 +1,162 @@
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from openstack import exceptions as sdk_exceptions
+
+from micado.launcher.openstack.openstack import OpenStackLauncher
+from micado.utils.utils import DataHandling
+
+CLOUDS = {
+    "a": ("https://a", "RegionOne", "p", "Default"),
+    "b": ("https://b", "RegionOne", "p", "Default"),
+}
+
+
+class Connection:
+    def __init__(self, servers=()):
+        self.servers = list(servers)
+        self.deleted = []
+
+    def delete_server(self, id):
+        self.deleted.append(id)
+        self.servers = [server for server in self.servers if server.id != id]
+        return True
+
+    def list_servers(self):
+        return self.servers
+
+
+def server(id, age):
+    created = datetime.now(timezone.utc) - timedelta(seconds=age)
+    return types.SimpleNamespace(
+        id=id, name=f"MiCADO-{id}", created=created.strftime("%Y-%m-%dT%H:%M:%SZ")
+    )
+
+
+@pytest.fixture
+def launcher(tmp_path, monkeypatch):
+    launcher = OpenStackLauncher()
+    monkeypatch.setattr(launcher, "home", f"{tmp_path}/")
+    launcher.connections = {}
+
+    def get_connection(auth_url, *args):
+        if auth_url == "https://b":
+            raise RuntimeError("authentication failed")
+        return launcher.connections.setdefault(auth_url, Connection())
+
+    monkeypatch.setattr(launcher, "_get_connection", get_connection)
+    for id, cloud in (("1" * 32, "a"), ("2" * 32, "b")):
+        auth_url, region_name, project_id, user_domain_name = CLOUDS[cloud]
+        DataHandling.persist_data(
+            f"{tmp_path}/data.yml",
+            id,
+            ip="10.0.0.1",
+            auth_url=auth_url,
+            region_name=region_name,
+            project_id=project_id,
+            user_domain_name=user_domain_name,
+        )
+    return launcher
+
+
+def test_delete_many_reports_each_cloud_and_keeps_failed_records(tmp_path, launcher):
+    results = launcher.delete_many(["1" * 32, "2" * 32, "unknown"])
+
+    assert results == {
+        "1" * 32: "Destroyed",
+        "2" * 32: "Failed: authentication failed",
+        "unknown": "Not found",
+    }
+    assert list(launcher.connections) == ["https://a"]
+    assert list(DataHandling.get_records(f"{tmp_path}/data.yml")) == ["2" * 32]
+
+
+def test_sweep_leaves_recorded_and_young_servers(tmp_path, launcher):
+    old, young = "a" * 32, "b" * 32
+    conn = Connection([server("1" * 32, 7200), server(old, 7200), server(young, 60)])
+    launcher.connections["https://a"] = conn
+
+    assert launcher.sweep("https://a") == {old: "Destroyed"}
+    assert conn.deleted == [old]
+    assert launcher.sweep("https://a", min_age=0) == {young: "Destroyed"}
+
+
+class Compute:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def create_server(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error:
+            raise self.error
+        return types.SimpleNamespace(id="server-1")
+
+
+def resource(id, name=None):
+    return types.SimpleNamespace(id=id, name=name or id)
+
+
+def create_server(launcher, compute):
+    conn = types.SimpleNamespace(compute=compute, session="session")
+    return launcher._create_server(
+        conn,
+        "RegionOne",
+        name="MiCADO-1",
+        image=resource("image-1"),
+        flavor=resource("flavor-1"),
+        network=resource("net-1"),
+        keypair=resource("key-1", "mykey"),
+        security_group=resource("sg-1"),
+        userdata="#cloud-config\n",
+    )
+
+
+@pytest.fixture
+def nova(monkeypatch):
+    from novaclient import client
+
+    servers = types.SimpleNamespace(created=[])
+    servers.create = lambda *args, **kwargs: servers.created.append(args) or "nova"
+    monkeypatch.setattr(
+        client, "Client", lambda *args, **kwargs: types.SimpleNamespace(servers=servers)
+    )
+    return servers
+
+
+def test_create_server_through_the_sdk(launcher, nova):
+    compute = Compute()
+    assert create_server(launcher, compute).id == "server-1"
+    assert compute.calls == [
+        {
+            "name": "MiCADO-1",
+            "image_id": "image-1",
+            "flavor_id": "flavor-1",
+            "key_name": "mykey",
+            "user_data": "I2Nsb3VkLWNvbmZpZwo=",
+            "networks": [{"uuid": "net-1"}],
+            "security_groups": [{"name": "sg-1"}],
+        }
+    ]
+    assert nova.created == []
+
+
+def test_create_server_falls_back_when_the_sdk_cannot_send(launcher, nova):
+    error = sdk_exceptions.EndpointNotFound("no compute endpoint")
+    assert create_server(launcher, Compute(error)) == "nova"
+    assert nova.created == [("MiCADO-1", "image-1", "flavor-1")]
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        sdk_exceptions.HttpException("500 Internal Server Error"),
+        sdk_exceptions.ResourceTimeout("timed out"),
+        sdk_exceptions.SDKException("unexpected response"),
+    ],
+)
+def test_create_server_does_not_fall_back_once_sent(launcher, nova, error):
+    with pytest.raises(type(error)):
+        create_server(launcher, Compute(error))
+    assert nova.created == []
@@ -0,0 +1,99 @@
+import threading
+import types
+
+import pytest
+
+from micado.installer.ansible import playbook as playbook_module
+from micado.installer.ansible.playbook import Playbook
+
+
+@pytest.fixture
+def fake_runner(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def run_async(event_handler, cancel_callback, **kwargs):
+        runner = types.SimpleNamespace(
+            status="running",
+            config=types.SimpleNamespace(artifact_dir=str(tmp_path / "artifacts")),
+        )
+
+        def run():
+            event_handler({"event": "playbook_on_start", "event_data": {}})
+            while not (release.wait(0.01) or cancel_callback()):
+                pass
+            runner.status = "canceled" if cancel_callback() else "successful"
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, runner
+
+    monkeypatch.setattr(playbook_module.ansible_runner.interface, "run_async", run_async)
+    (tmp_path / "micado-v0.12.6" / "playbook").mkdir(parents=True)
+    return release
+
+
+def test_run_async_returns_a_live_handle(tmp_path, fake_runner):
+    job = Playbook("v0.12.6", "abc", f"{tmp_path}/").run_async({}, {})
+    events = job.events()
+    assert next(events)["event"] == "playbook_on_start"
+    assert not job.done()
+
+    fake_runner.set()
+    assert job.wait(5).status == "successful"
+    assert list(events) == []
+    assert list(job.events()) == []
+    assert (tmp_path / "artifacts" / "timings.json").exists()
+
+
+def test_run_async_cancel(tmp_path, fake_runner):
+    job = Playbook("v0.12.6", "abc", f"{tmp_path}/").run_async({}, {})
+    job.cancel()
+    assert job.wait(5).status == "canceled"
+    assert job.status == "canceled"
+
+
+def test_run_async_reports_errors(tmp_path, monkeypatch):
+    def fetch(self):
+        raise TypeError("Download failed")
+
+    monkeypatch.setattr(Playbook, "fetch", fetch)
+    job = Playbook("v0.0.0", "abc", f"{tmp_path}/").run_async({}, {})
+    with pytest.raises(TypeError):
+        job.wait(5)
+    assert job.status == "error"
+
+
+@pytest.fixture
+def runner_kwargs(tmp_path, monkeypatch):
+    calls = []
+
+    def run(**kwargs):
+        calls.append(kwargs)
+        return types.SimpleNamespace(
+            config=types.SimpleNamespace(artifact_dir=str(tmp_path / "artifacts"))
+        )
+
+    monkeypatch.setattr(playbook_module.ansible_runner.interface, "run", run)
+    (tmp_path / "micado-v0.12.6" / "playbook").mkdir(parents=True)
+    return calls
+
+
+def test_accelerate_passes_the_performance_profile(tmp_path, runner_kwargs):
+    Playbook("v0.12.6", "abc", f"{tmp_path}/").run({}, {}, accelerate=True)
+    assert runner_kwargs[0]["envvars"] == {
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_SSH_ARGS": "-C -o ControlMaster=auto -o ControlPersist=600s",
+        "ANSIBLE_STRATEGY": "free",
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_GATHER_SUBSET": "!hardware,!facter,!ohai",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": "86400",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": str(tmp_path / "facts" / "abc"),
+    }
+
+
+def test_without_accelerate_the_environment_is_kept(tmp_path, runner_kwargs, monkeypatch):
+    monkeypatch.setenv("ANSIBLE_SSH_ARGS", "-o ProxyJump=bastion")
+    Playbook("v0.12.6", "abc", f"{tmp_path}/").run({}, {})
+    assert runner_kwargs[0]["envvars"] is None
+    assert not (tmp_path / "facts").exists()
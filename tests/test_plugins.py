@@ -0,0 +1,71 @@
+import subprocess
+import sys
+import types
+
+import pytest
+
+from micado.plugins import PluginRegistry
+
+IMPORT_BUDGET = 0.1  # seconds
+HEAVY_MODULES = (
+    "requests",
+    "openstack",
+    "novaclient",
+    "keystoneauth1",
+    "paramiko",
+    "ansible_runner",
+    "dicttoxml",
+    "Crypto",
+    "ruamel",
+)
+
+
+def test_import_micado_is_lightweight():
+    script = (
+        "import sys, time\n"
+        "preloaded = set(sys.modules)\n"
+        "start = time.perf_counter()\n"
+        "import micado\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules and m not in preloaded))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    elapsed, loaded = result.stdout.splitlines()
+    assert not loaded
+    assert float(elapsed) < IMPORT_BUDGET
+
+
+def test_import_micado_skips_ruamel_yaml():
+    # the ruamel namespace itself may be preloaded by a .pth file of ruamel.yaml
+    script = "import sys, micado\nprint('ruamel.yaml' in sys.modules)\n"
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_registry_imports_only_when_selected(monkeypatch):
+    module = types.ModuleType("fake_launcher")
+    module.FakeLauncher = type("FakeLauncher", (), {})
+    monkeypatch.setitem(sys.modules, "fake_launcher", module)
+
+    registry = PluginRegistry("micado.test", {"fake": "fake_launcher:FakeLauncher"})
+    assert not registry._loaded
+    assert registry["fake"] is module.FakeLauncher
+
+
+def test_registry_unknown_plugin(monkeypatch):
+    monkeypatch.setattr("micado.plugins._entry_points", lambda group: [])
+    registry = PluginRegistry("micado.test", {})
+    with pytest.raises(KeyError):
+        registry["unknown"]
+
+
+def test_registry_discovers_entry_points(monkeypatch):
+    entry_point = types.SimpleNamespace(name="extra", value="builtins:dict")
+    monkeypatch.setattr("micado.plugins._entry_points", lambda group: [entry_point])
+    registry = PluginRegistry("micado.test", {})
+    assert list(registry) == ["extra"]
+    assert registry["extra"] is dict
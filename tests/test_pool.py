@@ -0,0 +1,96 @@
+import itertools
+import time
+import types
+
+import pytest
+
+from micado.models.pool import WarmPool
+from micado.utils.utils import DataHandling
+
+SPEC = {"auth_url": "https://cloud", "image": "ubuntu", "flavor": "m1.medium"}
+
+
+class Launcher:
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.ids = (f"node-{i}" for i in itertools.count())
+        self.deleted = []
+
+    def launch(self, **kwargs):
+        id = next(self.ids)
+        DataHandling.persist_data(self.data_file, id, ip="10.0.0.1")
+        return types.SimpleNamespace(id=id, ip="10.0.0.1")
+
+    def delete(self, id):
+        self.deleted.append(id)
+
+    def delete_many(self, ids):
+        self.deleted.extend(ids)
+        DataHandling.remove_data(self.data_file, ids)
+        return {id: "Destroyed" for id in ids}
+
+
+@pytest.fixture
+def pool(tmp_path):
+    installer = types.SimpleNamespace(
+        micado_version="v0.12.6", deploy=lambda micado, **kwargs: None
+    )
+    return WarmPool(Launcher(tmp_path / "data.yml"), installer, f"{tmp_path}/", size=2)
+
+
+def test_fill_then_claim_oldest(pool):
+    assert pool.fill(**SPEC) == ["node-0", "node-1"]
+    assert pool.fill(**SPEC) == []
+
+    claimed = pool.claim(micado_password="secret", **SPEC)
+    assert claimed.id == "node-0"
+    assert list(pool.idle(pool.spec(**SPEC))) == ["node-1"]
+    assert pool.claim(**dict(SPEC, flavor="m1.large")) is None
+
+    pool.replenish(**SPEC).join(5)
+    assert list(pool.idle()) == ["node-1", "node-2"]
+
+
+def test_evicts_idle_and_stale_nodes(pool):
+    pool.fill(**SPEC)
+    stale = time.time() - 2 * pool.max_idle
+    DataHandling.update_data(pool.data_file, "node-0", pooled_at=stale)
+    DataHandling.update_data(pool.data_file, "node-1", version="v0.11.0")
+    assert pool.claim(**SPEC) is None
+    assert pool.launcher.deleted == ["node-0", "node-1"]
+
+
+def test_failed_install_deletes_the_node(pool):
+    def deploy(micado, **kwargs):
+        raise RuntimeError("playbook failed")
+
+    pool.installer.deploy = deploy
+    with pytest.raises(RuntimeError):
+        pool.fill(**SPEC)
+    assert pool.launcher.deleted == ["node-0"]
+    assert pool._warming[pool.spec(**SPEC)] == 0
+
+
+def test_install_options_do_not_split_the_pool(pool):
+    assert pool.spec(accelerate=True, full=True, **SPEC) == pool.spec(**SPEC)
+    assert pool.spec(**dict(SPEC, flavor="m1.large")) != pool.spec(**SPEC)
+
+
+def test_evicts_nodes_left_warming(pool):
+    from micado.models.pool import WARM_TIMEOUT
+
+    pool.fill(**SPEC)
+    abandoned = time.time() - WARM_TIMEOUT - pool.max_idle - 1
+    DataHandling.update_data(
+        pool.data_file, "node-0", pool_state="warming", warming_at=abandoned
+    )
+    DataHandling.update_data(
+        pool.data_file, "node-1", pool_state="warming", warming_at=time.time()
+    )
+    assert pool.evict() == {"node-0": "Destroyed"}
+
+
+def test_refills_are_not_daemon_threads(pool):
+    filler = pool.replenish(**SPEC)
+    assert not filler.daemon
+    filler.join(5)
@@ -0,0 +1,38 @@
+import socket
+
+import pytest
+
+from micado.exceptions import MicadoException
+from micado.installer.ansible import ports
+
+
+@pytest.fixture
+def open_port():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_wait_for_ports_reports_time_to_open(open_port):
+    default_timeout = socket.getdefaulttimeout()
+    times = ports.wait_for_ports("127.0.0.1", [open_port], timeout=5)
+    assert list(times) == [open_port]
+    assert times[open_port] < 5
+    assert socket.getdefaulttimeout() == default_timeout
+
+
+def test_wait_for_ports_times_out(monkeypatch, closed_port):
+    monkeypatch.setattr(ports, "RETRY_FIRST", 0.01)
+    with pytest.raises(MicadoException):
+        ports.wait_for_ports("127.0.0.1", [closed_port], timeout=0.1)
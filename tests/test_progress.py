@@ -0,0 +1,57 @@
+import json
+
+from micado.installer.ansible.progress import (
+    EventPipeline,
+    ProgressReporter,
+    TaskTimer,
+    failure_summary,
+)
+
+
+def event(name, task, role="", host="micado", duration=None, **data):
+    data.update(task=task, role=role, host=host, duration=duration)
+    data.setdefault("task_uuid", f"{role}-{task}")
+    return {"event": name, "event_data": data}
+
+
+EVENTS = [
+    event("playbook_on_task_start", "Install docker", "docker"),
+    event("runner_on_ok", "Install docker", "docker", "a", 30.0, res={"changed": True}),
+    event("runner_on_ok", "Install docker", "docker", "b", 40.0),
+    event("playbook_on_task_start", "Pull images", "docker"),
+    event("runner_on_ok", "Pull images", "docker", "a", 5.0),
+    event("playbook_on_task_start", "Start zorp", "zorp"),
+    event("runner_on_failed", "Start zorp", "zorp", "a", 2.0, res={"msg": "boom"}),
+]
+
+
+def test_timer_reports_slowest_first(tmp_path):
+    timer = TaskTimer()
+    for e in EVENTS:
+        timer(e)
+
+    report = json.loads(timer.write(tmp_path).read_text())
+    assert report["roles"] == [
+        {"role": "docker", "duration": 45.0},
+        {"role": "zorp", "duration": 2.0},
+    ]
+    assert [t["task"] for t in report["tasks"]] == ["Install docker", "Pull images", "Start zorp"]
+    assert report["tasks"][0]["hosts"] == 2
+
+
+def test_pipeline_streams_progress_and_survives_handler_errors():
+    seen = []
+
+    def broken(event):
+        raise RuntimeError
+
+    pipeline = EventPipeline(broken, None, ProgressReporter(seen.append))
+    assert all(pipeline(e) for e in EVENTS)
+    assert [p.status for p in seen] == [
+        "started", "changed", "ok", "started", "ok", "started", "failed"
+    ]
+    assert seen[-1].message == "boom"
+
+
+def test_failure_summary():
+    assert failure_summary(EVENTS) == "a: Start zorp: boom"
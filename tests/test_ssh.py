@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import hmac
+import os
+import subprocess
+import types
+
+import pytest
+
+from micado.exceptions import MicadoException
+from micado.installer.ansible import ssh
+from micado.installer.ansible.ssh import update_known_host
+
+
+def hashed(host, salt=b"0123456789abcdefghij"):
+    digest = hmac.new(salt, host.encode(), hashlib.sha1).digest()
+    return f"|1|{base64.b64encode(salt).decode()}|{base64.b64encode(digest).decode()}"
+
+
+def test_update_known_host_replaces_only_target(tmp_path):
+    known_hosts = tmp_path / "known_hosts"
+    known_hosts.write_text(
+        "# comment 192.0.2.1\n"
+        "192.0.2.1 ssh-ed25519 OLD1\n"
+        f"{hashed('192.0.2.1')} ssh-rsa OLD2\n"
+        "192.0.2.10,example.org ssh-ed25519 OTHER\n"
+        f"{hashed('192.0.2.2')} ssh-rsa OTHER2\n"
+        "@revoked 192.0.2.1 ssh-rsa REVOKED"
+    )
+
+    update_known_host("192.0.2.1", ["192.0.2.1 ssh-ed25519 NEW"], known_hosts)
+
+    assert known_hosts.read_text().splitlines() == [
+        "# comment 192.0.2.1",
+        "192.0.2.10,example.org ssh-ed25519 OTHER",
+        f"{hashed('192.0.2.2')} ssh-rsa OTHER2",
+        "@revoked 192.0.2.1 ssh-rsa REVOKED",
+        "192.0.2.1 ssh-ed25519 NEW",
+    ]
+    assert known_hosts.stat().st_mode & 0o777 == 0o600
+    assert not list(tmp_path.glob(".known_hosts.*"))
+
+
+def test_update_known_host_creates_file(tmp_path):
+    known_hosts = tmp_path / ".ssh" / "known_hosts"
+    update_known_host("192.0.2.1", ["192.0.2.1 ssh-ed25519 NEW\n"], known_hosts)
+    assert known_hosts.read_text() == "192.0.2.1 ssh-ed25519 NEW\n"
+
+
+@pytest.fixture
+def ssh_calls(monkeypatch):
+    calls = types.SimpleNamespace(args=[], kwargs=[], returncodes=[])
+
+    def run(args, **kwargs):
+        calls.args.append(args)
+        calls.kwargs.append(kwargs)
+        returncode = calls.returncodes.pop(0) if calls.returncodes else 0
+        if returncode and hasattr(kwargs.get("stderr"), "write"):
+            kwargs["stderr"].write(b"Connection refused")
+        return subprocess.CompletedProcess(args, returncode, b"content", b"")
+
+    monkeypatch.setattr(ssh.subprocess, "run", run)
+    monkeypatch.setattr(ssh.time, "sleep", lambda seconds: None)
+    return calls
+
+
+def test_open_retries_until_the_master_starts(ssh_calls):
+    ssh_calls.returncodes = [255, 255, 0]
+    session = ssh.SSHSession("192.0.2.1", "ubuntu", "key")
+    assert session.open(attempts=5) is session
+    assert session.is_open
+    assert len(ssh_calls.args) == 3
+
+    args, kwargs = ssh_calls.args[0], ssh_calls.kwargs[0]
+    assert [arg for arg in args if arg.startswith("ControlMaster")] == [
+        "ControlMaster=yes"
+    ]
+    assert args[-2:] == ["-fN", "ubuntu@192.0.2.1"]
+    assert kwargs["stdout"] is subprocess.DEVNULL
+    assert kwargs["stderr"] is not subprocess.PIPE
+    session.close()
+
+
+def test_open_gives_up_and_cleans_up(ssh_calls):
+    ssh_calls.returncodes = [255] * 3
+    session = ssh.SSHSession("192.0.2.1", "ubuntu", "key")
+    with pytest.raises(MicadoException):
+        session.open(attempts=3)
+    assert len(ssh_calls.args) == 3
+    assert not os.path.exists(session._control_dir)
+
+
+def test_get_quotes_the_remote_path(ssh_calls, tmp_path):
+    session = ssh.SSHSession("192.0.2.1", "ubuntu", "key")
+    session.get("/var/lib/micado/my cert.pem", tmp_path / "cert.pem")
+    assert ssh_calls.args[0][-1] == "cat '/var/lib/micado/my cert.pem'"
+    assert (tmp_path / "cert.pem").read_bytes() == b"content"
+    session.close()
+
+
+def test_close_stops_the_master(ssh_calls):
+    session = ssh.SSHSession("192.0.2.1", "ubuntu", "key").open()
+    session.close()
+    assert ssh_calls.args[-1] == [
+        "ssh", "-o", f"ControlPath={session.control_path}", "-O", "exit", "ubuntu@192.0.2.1"
+    ]
+    assert not session.is_open
+    assert not os.path.exists(session._control_dir)
+    session.close()
+    assert len(ssh_calls.args) == 2  # already closed
+
+
+def test_ansible_reuses_the_master():
+    session = ssh.SSHSession("192.0.2.1", "ubuntu", "key")
+    args = session.ansible_ssh_args.split()
+    assert f"ControlPath={session.control_path}" in args
+    assert "ControlMaster=auto" in args
+    assert "key" not in args
+    session.close()
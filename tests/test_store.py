@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from micado.utils import store
+from micado.utils.utils import DataHandling
+
+
+@pytest.fixture(params=["yaml", "sqlite"])
+def data_file(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "STORE", request.param)
+    return str(tmp_path / "data.yml")
+
+
+def test_node_lifecycle(data_file):
+    DataHandling.persist_data(data_file, "a", ip="10.0.0.1", auth_url="https://cloud")
+    DataHandling.persist_data(data_file, "b", ip="10.0.0.2")
+    DataHandling.update_data(data_file, "a", phase="launched")
+    DataHandling.update_data(data_file, "a", phase="ports_open")
+
+    assert DataHandling.get_properties(data_file, "a") == {
+        "ip": "10.0.0.1",
+        "auth_url": "https://cloud",
+        "phase": "ports_open",
+    }
+    with pytest.raises(LookupError):
+        DataHandling.get_properties(data_file, "missing")
+    with pytest.raises(LookupError):
+        DataHandling.update_data(data_file, "missing", phase="launched")
+
+    assert list(DataHandling.remove_data(data_file, ["a", "missing"])) == ["a"]
+    assert list(DataHandling.get_records(data_file)) == ["b"]
+
+
+def test_images(data_file):
+    DataHandling.persist_image(data_file, "v0.12.6", "img-1", auth_url="x")
+    DataHandling.persist_image(data_file, "v0.12.6", "img-2", auth_url="y")
+    assert DataHandling.get_image(data_file, "v0.12.6") == "img-2"
+    assert DataHandling.get_image(data_file, "v0.12.6", auth_url="x") == "img-1"
+
+
+def test_sqlite_imports_existing_yaml_once(tmp_path, monkeypatch):
+    data_file = str(tmp_path / "data.yml")
+    DataHandling.persist_data(data_file, "a", ip="10.0.0.1")
+    DataHandling.persist_image(data_file, "v0.12.6", "img-1")
+
+    monkeypatch.setattr(store, "STORE", "sqlite")
+    assert DataHandling.get_properties(data_file, "a") == {"ip": "10.0.0.1"}
+    assert DataHandling.get_image(data_file, "v0.12.6") == "img-1"
+
+    DataHandling.remove_data(data_file, ["a"])
+    assert DataHandling.get_records(data_file) == {}
+    assert (tmp_path / "data.db").exists()
+
+
+def test_import_yaml_is_idempotent(data_file):
+    yaml_store = store.YAMLStore(data_file)
+    yaml_store.persist_data("a", ip="10.0.0.1")
+    yaml_store.persist_data("b", ip="10.0.0.2")
+    yaml_store.persist_image("v0.12.6", id="img-1", auth_url="x")
+    yaml_store.persist_image("v0.12.6", id="img-2", auth_url="y")
+
+    assert DataHandling.import_yaml(data_file) == 2
+    assert DataHandling.import_yaml(data_file) == 2
+
+    for backend in (yaml_store, store.SQLiteStore(data_file)):
+        assert list(backend.get_records()) == ["a", "b"]
+        assert [i["id"] for i in backend.get_images("v0.12.6")] == ["img-1", "img-2"]
+
+
+def test_sqlite_schema_created_when_database_file_exists(tmp_path):
+    (tmp_path / "data.db").touch()  # opened by another process, no tables yet
+    store.SQLiteStore(str(tmp_path / "data.yml")).persist_data("a", ip="10.0.0.1")
+    assert list(store.SQLiteStore(str(tmp_path / "data.yml")).get_records()) == ["a"]
+
+
+def test_batch_writes_once(data_file, monkeypatch):
+    DataHandling.persist_data(data_file, "a", ip="10.0.0.1")
+    DataHandling.persist_data(data_file, "b", ip="10.0.0.2")
+    with DataHandling.batch(data_file) as batch:
+        batch.update_data("a", phase="launched")
+        batch.update_data("b", phase="launched")
+        batch.persist_data("c", ip="10.0.0.3")
+        assert list(batch.get_records()) == ["a", "b", "c"]
+
+    records = DataHandling.get_records(data_file)
+    assert [records[id].get("phase") for id in "abc"] == ["launched"] * 2 + [None]
+
+    with pytest.raises(LookupError):
+        with DataHandling.batch(data_file) as batch:
+            batch.remove_data(["a"])
+            batch.update_data("missing", phase="launched")
+    assert list(DataHandling.get_records(data_file)) == ["a", "b", "c"]
+
+
+def test_concurrent_writers_keep_every_record(data_file):
+    DataHandling.persist_data(data_file, "first", ip="10.0.0.0")
+    ids = [f"node-{i}" for i in range(20)]
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(lambda id: DataHandling.persist_data(data_file, id), ids))
+
+    assert sorted(DataHandling.get_records(data_file)) == sorted(ids + ["first"])
+
+
+def test_yaml_write_is_atomic(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "STORE", "yaml")
+    data_file = str(tmp_path / "data.yml")
+    DataHandling.persist_data(data_file, "a", ip="10.0.0.1")
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store.YAML, "dump", crash)
+    with pytest.raises(OSError):
+        DataHandling.update_data(data_file, "a", phase="launched")
+
+    assert DataHandling.get_properties(data_file, "a") == {"ip": "10.0.0.1"}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["data.yml", "data.yml.lock"]
+
+
+def test_yaml_unreadable_file_is_not_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "STORE", "yaml")
+    data_file = tmp_path / "data.yml"
+    data_file.write_text("micados: [a: {ip: 10.0.0.1}\n")
+
+    with pytest.raises(Exception):
+        DataHandling.persist_data(str(data_file), "b", ip="10.0.0.2")
+    assert data_file.read_text() == "micados: [a: {ip: 10.0.0.1}\n"
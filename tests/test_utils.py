@@ -0,0 +1,37 @@
+import pytest
+
+from micado.utils.utils import DataHandling
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = str(tmp_path / "data.yml")
+    for server_id in ("a", "b", "c"):
+        DataHandling.persist_data(path, server_id, ip=f"10.0.0.{server_id}")
+    return path
+
+
+def test_get_records(data_file):
+    records = DataHandling.get_records(data_file)
+    assert list(records) == ["a", "b", "c"]
+    assert records["b"]["ip"] == "10.0.0.b"
+
+
+def test_remove_data_single_write(data_file):
+    removed = DataHandling.remove_data(data_file, ["a", "c", "missing"])
+    assert sorted(removed) == ["a", "c"]
+    assert list(DataHandling.get_records(data_file)) == ["b"]
+
+
+def test_remove_data_missing_file(tmp_path):
+    assert DataHandling.remove_data(str(tmp_path / "data.yml"), ["a"]) == {}
+
+
+def test_images_lookup_latest_match(data_file):
+    DataHandling.persist_image(data_file, "v1", "img-1", auth_url="x")
+    DataHandling.persist_image(data_file, "v1", "img-2", auth_url="y")
+    DataHandling.persist_image(data_file, "v1", "img-3", auth_url="x")
+    assert DataHandling.get_image(data_file, "v1", auth_url="x") == "img-3"
+    with pytest.raises(LookupError):
+        DataHandling.get_image(data_file, "v2", auth_url="x")
+    assert list(DataHandling.get_records(data_file)) == ["a", "b", "c"]